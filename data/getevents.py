@@ -1,13 +1,24 @@
 import os
+import sys
 import json
 import time
+import heapq
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from elasticsearch import Elasticsearch
 from elasticsearch import helpers
 from elasticsearch.helpers import bulk
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from sysflow.sfql import SfqlInterpreter, SfqlMapper
+from sysflow.esquery import SfqlEsCompiler
 
-def setSearchOptional(beginTime="2022-12-12T12:12:12", endTime=datetime.now().strftime("%Y-%m-%dT%H:%M:%S")):
+
+def setSearchOptional(beginTime="2022-12-12T12:12:12", endTime=None):
+    # the default end is resolved on each call, so that long-running callers see new events
+    endTime = endTime or datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
     esSearchOptions = {
         "query": {
             "range":{
@@ -21,44 +32,287 @@ def setSearchOptional(beginTime="2022-12-12T12:12:12", endTime=datetime.now().st
     return esSearchOptions
 
 
-def getResult(esResult, index):
-    with open(index + '.log', 'w+') as f:
-        data = []
-        for item in esResult:
-            source = item['_source']
-            if 'process' in source and 'aname' in source['process']:
-                source['process']['aname'] = source['process']['aname'].split(',')
-            if 'event' in source and 'opflags' in source['event']:
-                source['event']['opflags'] = source['event']['opflags'].split()
-            data.append((item['_source']['timestamp'], str(item['_source'])))
-            data.sort(reverse=False)
-        for d in data:
-            f.write(str(d[1])+'\n')
+# record fields the export and the sysflow readers always need
+REQUIRED_FIELDS = [
+    'timestamp',
+    'head',
+    'event.sf_type',
+    'event.opflags_int',
+    'container.id',
+    'process.oid',
+    'pprocess.oid',
+    'file.path',
+    'file.newpath',
+]
+
+
+def getSourceFields(fields=[], exprs=[], paths=[]):
+    """Returns the _source includes needed for the given record fields, sfql
+    expressions and policy files, on top of REQUIRED_FIELDS."""
+    mapper = SfqlMapper()
+    attrs = set(fields)
+    # expressions may refer to the lists and macros of the policy files
+    interpreter = SfqlInterpreter(paths=paths)
+    for expr in exprs:
+        interpreter.compile(expr)
+        attrs.update(interpreter.getQueryAttributes())
+    if paths:
+        attrs.update(interpreter.getPolicyAttributes())
+    includes = set(REQUIRED_FIELDS).union(attrs)
+    for attr in attrs:
+        includes.update(mapper.getSourceFields(attr))
+    return sorted(includes)
+
+
+FORMATS = {
+    'json': json.dumps,
+    'repr': str,
+}
+
+
+# default memory budget (in bytes) for buffering events before spilling a sorted run to disk
+MAX_SORT_BYTES = 256 * 1024 * 1024
+
+
+def getSource(item):
+    source = item['_source']
+    if 'process' in source and 'aname' in source['process']:
+        source['process']['aname'] = source['process']['aname'].split(',')
+    if 'event' in source and 'opflags' in source['event']:
+        source['event']['opflags'] = source['event']['opflags'].split()
+    return source
+
+
+def getEntries(esResult, format='json'):
+    """Yields '<timestamp>\\t<record>\\n' sort entries; comparing entries as strings
+    orders them by (timestamp, record), like sorting (timestamp, record) tuples."""
+    serialize = FORMATS[format]
+    for item in esResult:
+        source = getSource(item)
+        yield source['timestamp'] + '\t' + serialize(source) + '\n'
 
 
-def getSearchResult(esSearchOptions, scroll='5m', index='events', timeout="1m"):
+def spillRun(data):
+    data.sort()
+    run = tempfile.TemporaryFile(mode='w+', encoding='utf-8')
+    run.writelines(data)
+    run.seek(0)
+    return run
+
+
+def externalSort(entries, maxbytes=MAX_SORT_BYTES):
+    """Sorts entries holding at most about maxbytes of them in memory; full buffers
+    are sorted and spilled to temporary run files, which are k-way merged at the end."""
+    runs = []
+    data = []
+    size = 0
+    for entry in entries:
+        data.append(entry)
+        size += len(entry)
+        if size >= maxbytes:
+            runs.append(spillRun(data))
+            data = []
+            size = 0
+    data.sort()
+    try:
+        yield from heapq.merge(*runs, data)
+    finally:
+        for run in runs:
+            run.close()
+
+
+def writeLog(entries, index, mode='w+', create=True):
+    """Writes the records of sorted entries to the log <index>.log. Unless create is set,
+    the log is only opened once there is a record to write, so that no empty log is left."""
+    f = open(index + '.log', mode) if create else None
+    try:
+        for entry in entries:
+            if f is None:
+                f = open(index + '.log', mode)
+            f.write(entry.partition('\t')[2])
+    finally:
+        if f is not None:
+            f.close()
+
+
+def getResult(esResult, index, format='json', maxbytes=MAX_SORT_BYTES, mode='w+', create=True):
+    writeLog(externalSort(getEntries(esResult, format), maxbytes), index, mode, create)
+
+
+def getSearchResult(esSearchOptions, scroll='5m', index='events', timeout="1m", esClient=None, preserve_order=False):
     esResult = helpers.scan(
-        client=client,
+        client=esClient or client,
         query=esSearchOptions,
         scroll=scroll,
         index=index,
-        timeout=timeout
+        timeout=timeout,
+        preserve_order=preserve_order
     )
     return esResult
 
 
-def search(index):
-    esSearchOptions = setSearchOptional()
-    esResult = getSearchResult(esSearchOptions)
-    getResult(esResult, index)
+def getSlicedSearchResult(esSearchOptions, slices, scroll='5m', index='events', timeout="1m"):
+    return [
+        getSearchResult(dict(esSearchOptions, slice={"id": i, "max": slices}), scroll, index, timeout)
+        for i in range(slices)
+    ]
+
+
+def getSlice(esResult, path, format='json', maxbytes=MAX_SORT_BYTES):
+    """Writes the sorted entries of one scroll slice to the partition file at path."""
+    t1 = time.time()
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for entry in externalSort(getEntries(esResult, format), maxbytes):
+            f.write(entry)
+            count += 1
+    return count, time.time() - t1
+
+
+def getSlicedResult(esResults, index, format='json', maxbytes=MAX_SORT_BYTES, mode='w+', create=True):
+    """Exports each slice to its own sorted partition in a worker thread, then k-way
+    merges the partitions into a single timestamp-ordered log."""
+    slices = len(esResults)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = [os.path.join(tmpdir, '{0}.{1}.log'.format(index, i)) for i in range(slices)]
+        with ThreadPoolExecutor(max_workers=slices) as executor:
+            futures = [
+                executor.submit(getSlice, esResult, path, format, maxbytes // slices)
+                for esResult, path in zip(esResults, paths)
+            ]
+            for i, future in enumerate(futures):
+                count, secs = future.result()
+                print("slice {0}: {1} events in {2:.2f}s ({3:.0f} events/s)".format(i, count, secs, count / secs if secs else 0))
+        parts = [open(path, 'r', encoding='utf-8') for path in paths]
+        try:
+            writeLog(heapq.merge(*parts), index, mode, create)
+        finally:
+            for part in parts:
+                part.close()
+
+
+def loadState(path):
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def saveState(path, state):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def getNewEvents(esResult, state):
+    """Skips events already exported according to the watermark in state, i.e., events
+    older than state['ts'] (head.ts) or at state['ts'] with an id in state['ids'], and
+    advances the watermark in place over the events it yields."""
+    ts = state.get('ts', -1)
+    ids = set(state.get('ids', []))
+    maxts, maxids, timestamp = ts, set(ids), state.get('timestamp')
+    for item in esResult:
+        source = item['_source']
+        its = source['head']['ts']
+        if its < ts or (its == ts and item['_id'] in ids):
+            continue
+        if its > maxts:
+            maxts, maxids, timestamp = its, {item['_id']}, source['timestamp']
+        elif its == maxts:
+            maxids.add(item['_id'])
+        yield item
+    if timestamp is not None:
+        state.update(ts=maxts, ids=sorted(maxids), timestamp=timestamp)
+
+
+def mergeStates(states):
+    maxts = max(state.get('ts', -1) for state in states)
+    merged = {}
+    for state in states:
+        if state.get('ts', -1) == maxts and 'timestamp' in state:
+            merged.update(ts=maxts, timestamp=state['timestamp'])
+            merged['ids'] = sorted(set(merged.get('ids', [])).union(state['ids']))
+    return merged
+
+
+def getSearchOptions(beginTime=None, includes=None, pushdown=None):
+    esSearchOptions = setSearchOptional(beginTime=beginTime) if beginTime else setSearchOptional()
+    if includes:
+        esSearchOptions["_source"] = includes
+    if pushdown:
+        esSearchOptions["query"] = {"bool": {"filter": [esSearchOptions["query"], pushdown]}}
+    return esSearchOptions
+
+
+# server-side sort giving streamed events the chronological order of an events log
+EVENTS_SORT = [{"head.ts": "asc"}]
+
+
+def exportEvents(host="http://localhost:9200", index='events', includes=None, pushdown=None, beginTime=None):
+    """Yields the exported events as decoded dictionaries, in chronological order, without
+    writing an events log. Events are sorted by elasticsearch and pulled lazily from the
+    scroll, so the generator can feed sysflow.graphlet.Graphlet or SFFormatter directly."""
+    esClient = Elasticsearch(host)
+    esSearchOptions = getSearchOptions(beginTime, includes, pushdown)
+    esSearchOptions["sort"] = EVENTS_SORT
+    for item in getSearchResult(esSearchOptions, index=index, esClient=esClient, preserve_order=True):
+        yield getSource(item)
+
+
+def search(index, format='json', maxbytes=MAX_SORT_BYTES, slices=1, incremental=False, partition=False, includes=None, pushdown=None):
+    output, mode, create = index, 'w+', True
+    state = {}
+    if incremental:
+        statePath = index + '.state.json'
+        state = loadState(statePath)
+        if partition:
+            # polls without new events leave no empty partition behind
+            output, create = '{0}.{1}'.format(index, state.get('ts', 0)), False
+        else:
+            mode = 'a'
+    esSearchOptions = getSearchOptions(state.get('timestamp'), includes, pushdown)
+    if slices > 1:
+        states = [dict(state) for i in range(slices)]
+        esResults = [
+            getNewEvents(esResult, s) if incremental else esResult
+            for esResult, s in zip(getSlicedSearchResult(esSearchOptions, slices), states)
+        ]
+        getSlicedResult(esResults, output, format, maxbytes, mode, create)
+        state = mergeStates(states)
+    else:
+        esResult = getSearchResult(esSearchOptions)
+        esResult = getNewEvents(esResult, state) if incremental else esResult
+        getResult(esResult, output, format, maxbytes, mode, create)
+    if incremental and state:
+        saveState(statePath, state)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export sysflow events from elasticsearch into an events log.')
+    parser.add_argument('-f', '--format', help='events log format (json: JSON-Lines, repr: legacy python dict repr)', choices=list(FORMATS), default='json')
+    parser.add_argument('-m', '--memory', help='memory budget in MB for sorting events before spilling to disk', type=int, default=MAX_SORT_BYTES // (1024 * 1024))
+    parser.add_argument('-s', '--slices', help='number of scroll slices exported in parallel', type=int, default=1)
+    parser.add_argument('-i', '--incremental', help='export only events newer than the last run (watermark kept in <index>.state.json) and append them to the log', action='store_true')
+    parser.add_argument('-p', '--partition', help='with --incremental, write new events to a new partition <index>.<watermark>.log instead of appending', action='store_true')
+    parser.add_argument('-c', '--fields', help='comma-separated list of record fields to export (default: all)', default=None)
+    parser.add_argument('-q', '--query', help='sfql expression whose fields are exported (repeatable)', action='append', default=[])
+    parser.add_argument('-d', '--policy', help='policy file providing lists and macros, whose fields are also exported with --fields/--query (repeatable)', action='append', default=[])
+    parser.add_argument('-P', '--pushdown', help='sfql expression pushed down to elasticsearch; only candidate events are exported (subexpressions that cannot be translated are left to the local filter)', default=None)
+    parser.add_argument('--keyword', help='suffix of the keyword sub-field of string fields (e.g., .keyword)', default='')
+    parser.add_argument('--host', help='elasticsearch url', default="http://localhost:9200")
+    args = parser.parse_args()
     index = "events"
+    includes = None
+    if args.fields or args.query:
+        fields = args.fields.split(',') if args.fields else []
+        includes = getSourceFields(fields, args.query, args.policy)
+    pushdown = None
+    if args.pushdown:
+        pushdown = SfqlEsCompiler(args.pushdown, args.policy, args.keyword).getQuery()
 
     t1 = time.time()
-    client = Elasticsearch("http://localhost:9200")
-    search(index)
+    client = Elasticsearch(args.host)
+    search(index, args.format, args.memory * 1024 * 1024, args.slices, args.incremental, args.partition, includes, pushdown)
 
     t2 = time.time()
     print("---------Done!--------", t2-t1)
\ No newline at end of file
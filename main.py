@@ -1,11 +1,11 @@
-import sys, os, json
+import sys, json
 sys.path.append('src')
-from sysflow.graphlet import Graphlet
+sys.path.append('data')
+from sysflow.graphlet import Graphlet, REQUIRED_FIELDS
+from getevents import exportEvents, getSourceFields
 import warnings
 import pandas as pd
 import numpy as np
-import os
-os.system("python data/getevents.py")
 
 warnings.filterwarnings("ignore")
 pd.set_option('display.max_rows', None)
@@ -19,6 +19,9 @@ ioc = 'process.exe = /usr/bin/lsblk and container.image.name = attackanalyze:lat
 ioc = 'file.path = /bin/cat and process.command_line contains cat'
 ioc = 'process.oldname = df'
 ioc = 'process.oldname = lsblk'
-graph = Graphlet('data/events.log', ioc, ['src/policies/ttps.yaml'])
+policies = ['src/policies/ttps.yaml']
+# stream only the output columns, the fields keying the graphlet entities, the ioc and the policies from elasticsearch into the graphlet
+events = exportEvents(includes=getSourceFields(REQUIRED_FIELDS + cols, [ioc], policies))
+graph = Graphlet(events, ioc, policies)
 graph.view(withoid=True, peek=True, peeksize=3, flows=True, ttps=True)
 graph.data()[cols].to_csv("result/result.csv", sep=",")
\ No newline at end of file
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+import ast, re
+import json
+
+try:
+    import orjson as _backend
+except ImportError:
+    try:
+        import ujson as _backend
+    except ImportError:
+        _backend = json
+
+"""
+.. module:: sysflow.decoder
+   :synopsis: Record decoders turning exported event log lines into python dictionaries.
+.. moduleauthor:: Frederico Araujo, Teryl Taylor
+"""
+
+JSON_BACKEND = _backend.__name__
+
+_REPR_TOKENS = re.compile(r"""'((?:[^'\\]|\\.)*)'|"((?:[^"\\]|\\.)*)"|\b(True|False|None)\b|([()])""")
+_REPR_ESCAPES = re.compile(r"""\\(x[0-9a-fA-F]{2}|U[0-9a-fA-F]{8}|'|.)""")
+_REPR_KEYWORDS = {'True': 'true', 'False': 'false', 'None': 'null', '(': '[', ')': ']'}
+
+
+def _reprEscape(m):
+    esc = m.group(1)
+    if esc == "'":
+        return esc
+    if esc[0] == 'x':
+        return '\\u00' + esc[1:]
+    if esc[0] == 'U':
+        return json.dumps(chr(int(esc[1:], 16)))[1:-1]
+    return m.group(0)
+
+
+def _reprToken(m):
+    s = m.group(1)
+    if s is not None:
+        if '\\' in s:
+            s = _REPR_ESCAPES.sub(_reprEscape, s)
+        if '"' in s:
+            s = s.replace('"', '\\"')
+        return '"' + s + '"'
+    s = m.group(2)
+    if s is not None:
+        return m.group(0) if '\\' not in s else '"' + _REPR_ESCAPES.sub(_reprEscape, s) + '"'
+    return _REPR_KEYWORDS[m.group(m.lastindex)]
+
+
+class SFDecoder(object):
+    """
+    **SFDecoder**
+
+    Base class for record decoders. A decoder turns one line of an exported events log
+    into the dictionary representation of a sysflow record.
+    """
+
+    name = None
+
+    def decode(self, line):
+        """Decode a single events log line.
+
+        :param line: a line from the events log.
+        :type line: str
+
+        :rtype: dict
+        :return: the decoded record.
+        """
+        raise NotImplementedError
+
+    def __call__(self, line):
+        return self.decode(line)
+
+
+class JsonDecoder(SFDecoder):
+    """
+    **JsonDecoder**
+
+    Strict decoder for JSON-Lines (NDJSON) event logs. Uses the fastest JSON backend
+    available (orjson, ujson, or the standard library json module).
+    """
+
+    name = 'json'
+
+    def __init__(self):
+        self._loads = _backend.loads
+
+    def decode(self, line):
+        return self._loads(line)
+
+
+class ReprDecoder(SFDecoder):
+    """
+    **ReprDecoder**
+
+    Compatibility decoder for legacy event logs written as python dictionary reprs
+    (``str(dict)``). Lines are rewritten token by token into JSON and handed to the JSON
+    backend, so no code from the log is ever executed. Literals the rewrite cannot
+    express in JSON are handled by ``ast.literal_eval``.
+    """
+
+    name = 'repr'
+
+    def __init__(self):
+        self._loads = _backend.loads
+
+    def decode(self, line):
+        try:
+            return self._loads(_REPR_TOKENS.sub(_reprToken, line))
+        except ValueError:
+            return ast.literal_eval(line)
+
+
+class DictDecoder(SFDecoder):
+    """
+    **DictDecoder**
+
+    Pass-through decoder for records that are already decoded, e.g., events streamed
+    as dictionaries straight from an exporter instead of being read from a log.
+    """
+
+    name = 'dict'
+
+    def decode(self, line):
+        return line
+
+
+DECODERS = {
+    JsonDecoder.name: JsonDecoder,
+    ReprDecoder.name: ReprDecoder,
+    DictDecoder.name: DictDecoder,
+}
+
+
+def detectDecoder(line):
+    """Returns a decoder instance able to read a log whose first line is line.
+
+    JSON-Lines logs are preferred, since they take the fast decoding path; anything
+    that is not valid JSON is assumed to be a legacy python repr log.
+
+    :param line: the first line of an events log.
+    :type line: str
+
+    :rtype: sysflow.decoder.SFDecoder
+    :return: the decoder object.
+    """
+    decoder = JsonDecoder()
+    if not line.strip():
+        return decoder
+    try:
+        decoder.decode(line)
+    except ValueError:
+        return ReprDecoder()
+    return decoder
+
+
+def getDecoder(decoder):
+    """Returns a decoder instance.
+
+    :param decoder: a decoder name (see DECODERS) or a SFDecoder instance.
+    :type decoder: str or sysflow.decoder.SFDecoder
+
+    :rtype: sysflow.decoder.SFDecoder
+    :return: the decoder object.
+    """
+    if isinstance(decoder, SFDecoder):
+        return decoder
+    if decoder not in DECODERS:
+        raise Exception('Unknown record decoder {0}'.format(decoder))
+    return DECODERS[decoder]()
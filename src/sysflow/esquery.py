@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+
+import re
+from sysflow.sfql import SfqlInterpreter
+
+"""
+.. module:: sysflow.esquery
+   :synopsis: Translation of sfql expressions into Elasticsearch query DSL for filter pushdown.
+.. moduleauthor:: Frederico Araujo, Teryl Taylor
+"""
+
+# attributes stored as numbers in the events index
+_NUMERIC = {
+    'head.ts', 'head.endts',
+    'event.sf_ret', 'event.opflags_int',
+    'pod.ts', 'pod.restartcnt',
+    'file.openflags_int',
+    'file_action.bytes_read', 'file_action.read_ops', 'file_action.bytes_written', 'file_action.write_ops',
+    'network.rbytes', 'network.wbytes', 'network.iana_number', 'network.gap_time',
+    'source.bytes', 'source.packets', 'source.port',
+    'destination.bytes', 'destination.packets', 'destination.port',
+    'process.tid', 'process.oid.hpid', 'process.oid.createTS', 'process.uid', 'process.gid',
+    'pprocess.oid.hpid', 'pprocess.oid.createTS', 'pprocess.uid', 'pprocess.gid',
+}
+
+# attributes whose indexed form differs from what sfql matches on (lists, booleans, objects)
+_UNTRANSLATABLE = {
+    'process.aname', 'process.tty', 'pprocess.tty', 'container.privileged',
+    'file.is_open_read', 'file.is_open_write', 'file.oid', 'file.newoid',
+}
+
+_INT = re.compile(r'-?[0-9]+')
+_REGEXP_RESERVED = re.compile(r'([.?+*|{}\[\]()"\\#@&<>~])')
+
+_RANGE_OPS = {'GT': 'gt', 'GE': 'gte', 'LT': 'lt'}
+
+
+def _isCanonical(v):
+    # sfql tests equality of numbers on their strings, which only the canonical form of an integer matches
+    return bool(_INT.fullmatch(v)) and str(int(v)) == v
+
+
+def _regexp(v):
+    return _REGEXP_RESERVED.sub(r'\\\1', v)
+
+
+class SfqlEsCompiler(SfqlInterpreter):
+    """
+    **SfqlEsCompiler**
+
+    This class compiles a sfql query into an Elasticsearch query that selects a superset of the
+    matching events, plus a residual predicate for the parts of the query that cannot be expressed
+    in the query DSL. An event matches the sfql query iff the Elasticsearch query selects it and
+    the residual predicate holds for its flattened record.
+    Example Usage::
+
+         compiler = SfqlEsCompiler('process.name = lsblk and process.exe contains bin', paths=['policies/ttps.yaml'])
+         esSearchOptions = {'query': compiler.getQuery()}
+         ...
+         for r in compiler.filterResidual(reader):
+             print(r)
+
+    :param query: sfql query.
+    :type query: str
+
+    :param paths: a list of paths to file containing sfql list and macro definitions.
+    :type paths: list
+
+    :param keyword: suffix appended to string field names (e.g., '.keyword' for dynamically mapped indices).
+    :type keyword: str
+    """
+
+    def __init__(self, query: str = None, paths: list = [], keyword: str = ''):
+        self.keyword = keyword
+        self._query = None
+        self._residual = None
+        self._ruleExpressions = dict()
+        super().__init__(query, list(paths), [])
+
+    def getQuery(self) -> dict:
+        """Return the Elasticsearch query selecting the candidate events."""
+        return self._query if self._query else {'match_all': {}}
+
+    def getResidual(self):
+        """Return the residual predicate to be evaluated locally, or None if the whole query is pushed down."""
+        return self._residual
+
+    def filterResidual(self, reader):
+        """Filter iterable reader over pushed-down results according to the residual predicate.
+
+        :param reader: sysflow reader
+        :type reader: FlattenedSFReader
+        """
+        if not self._residual:
+            return reader
+        return filter(self._residual, reader)
+
+    def getRulePushdown(self, name: str):
+        """Return the (query, residual) pair for the condition of policy rule name."""
+        query, residual, tree = self._pushExpression(self._ruleExpressions[name])
+        return query if query else {'match_all': {}}, self._compileResidual(residual, name)
+
+    def _defineQuery(self, tree: tuple):
+        super()._defineQuery(tree)
+        self._query, residual, tree = self._pushExpression(self._queryTree)
+        self._residual = self._compileResidual(residual, 'residual')
+
+    def _defineRule(self, name: str, *args):
+        super()._defineRule(name, *args)
+        self._ruleExpressions[name] = self._rules[name].tree
+
+    def _compileResidual(self, residual: tuple, name: str):
+        return self._compileTree(residual, name) if residual else None
+
+    # Each _push method takes a resolved expression tree and returns a triple (query, residual, tree):
+    # query is a DSL query selecting a superset of the matches (None for all events), residual is the
+    # tree left to evaluate locally (None if query is exact), and tree is the exact expression.
+
+    def _pushExpression(self, tree: tuple):
+        return self._pushAny([self._pushAll([self._pushTerm(term) for term in and_expression[1]]) for and_expression in tree[1]])
+
+    def _pushAll(self, parts):
+        if len(parts) == 1:
+            return parts[0]
+        queries = [q for q, r, t in parts if q]
+        residuals = [r for q, r, t in parts if r]
+        query = None
+        if queries:
+            query = queries[0] if len(queries) == 1 else {'bool': {'filter': queries}}
+        residual = None
+        if residuals:
+            residual = residuals[0] if len(residuals) == 1 else ('and', tuple(residuals))
+        return query, residual, ('and', tuple(t for q, r, t in parts))
+
+    def _pushAny(self, parts):
+        if len(parts) == 1:
+            return parts[0]
+        tree = ('or', tuple(t for q, r, t in parts))
+        query = None
+        if all(q for q, r, t in parts):
+            query = {'bool': {'should': [q for q, r, t in parts], 'minimum_should_match': 1}}
+        if any(r for q, r, t in parts):
+            return query, tree, tree
+        return query, None, tree
+
+    def _pushTerm(self, tree: tuple):
+        kind = tree[0]
+        if kind == 'or':
+            return self._pushExpression(tree)
+        elif kind == 'not':
+            query, residual, t = self._pushTerm(tree[1])
+            if query and not residual:
+                return {'bool': {'must_not': [query]}}, None, tree
+        elif kind == 'exists':
+            query = self._fieldQuery(tree[1], self._existsQuery)
+            if query:
+                return query, None, tree
+        elif kind == 'op':
+            op, lop, rop = tree[1:]
+            if not self.mapper.hasAttr(rop):
+                value = self.mapper.getAttr(None, rop)
+                query = self._fieldQuery(lop, lambda f, num: self._binaryQuery(f, num, op, value))
+                if query:
+                    return query, None, tree
+        elif kind in ('in', 'pmatch'):
+            lop, values = tree[1], list(tree[2])
+            build = self._inQuery if kind == 'in' else self._pmatchQuery
+            query = self._fieldQuery(lop, lambda f, num: build(f, num, values))
+            if query:
+                return query, None, tree
+        return None, tree, tree
+
+    def _fieldQuery(self, attr, build):
+        """Build the query on the index field(s) backing attr, or None if attr is not translatable."""
+        if not self.mapper.hasAttr(attr) or attr in _UNTRANSLATABLE:
+            return None
+        if attr == 'file.path':
+            # directories report their path through file.directory
+            isdir = {'term': {'file.type' + self.keyword: 'dir'}}
+            qdir = build('file.directory' + self.keyword, False)
+            qpath = build('file.path' + self.keyword, False)
+            if qdir is None or qpath is None:
+                return None
+            return {
+                'bool': {
+                    'should': [
+                        {'bool': {'filter': [isdir, qdir]}},
+                        {'bool': {'must_not': [isdir], 'filter': [qpath]}},
+                    ],
+                    'minimum_should_match': 1,
+                }
+            }
+        if self.mapper.getSourceFields(attr) != [attr]:
+            return None
+        if attr in _NUMERIC:
+            return build(attr, True)
+        return build(attr + self.keyword, False)
+
+    def _existsQuery(self, field, numeric):
+        empty = 0 if numeric else ''
+        return {'bool': {'filter': [{'exists': {'field': field}}], 'must_not': [{'term': {field: empty}}]}}
+
+    def _withMissing(self, field, query, matchesMissing):
+        # the interpreter matches absent attributes as the string 'None'
+        if not matchesMissing:
+            return query
+        missing = {'bool': {'must_not': [{'exists': {'field': field}}]}}
+        return {'bool': {'should': [query, missing], 'minimum_should_match': 1}}
+
+    def _binaryQuery(self, field, numeric, op, value):
+        if numeric:
+            if not _INT.fullmatch(value) or op in ('EQ', 'NEQ') and not _isCanonical(value):
+                return None
+            if op == 'EQ':
+                return {'term': {field: int(value)}}
+            if op == 'NEQ':
+                return {'bool': {'must_not': [{'term': {field: int(value)}}]}}
+            if op in _RANGE_OPS:
+                return {'range': {field: {_RANGE_OPS[op]: int(value)}}}
+            return None
+        # string attributes match if any of their comma-separated parts does
+        if ',' in value:
+            return None
+        v = _regexp(value)
+        if op == 'EQ':
+            query = {'regexp': {field: {'value': '(.*,)?{0}(,.*)?'.format(v)}}}
+            return self._withMissing(field, query, value == 'None')
+        if op == 'NEQ':
+            if value == 'None':
+                return None
+            return {'bool': {'must_not': [{'regexp': {field: {'value': '{0}(,{0})*'.format(v)}}}]}}
+        if op == 'CONTAINS':
+            query = {'regexp': {field: {'value': '.*{0}.*'.format(v)}}}
+            return self._withMissing(field, query, value in 'None')
+        if op == 'ICONTAINS':
+            query = {'regexp': {field: {'value': '.*{0}.*'.format(_regexp(value.lower())), 'case_insensitive': True}}}
+            return self._withMissing(field, query, value.lower() in 'none')
+        if op == 'STARTSWITH':
+            query = {'regexp': {field: {'value': '(.*,)?{0}.*'.format(v)}}}
+            return self._withMissing(field, query, 'None'.startswith(value))
+        return None
+
+    def _inQuery(self, field, numeric, values):
+        if not values:
+            return None
+        if numeric:
+            if not all(_isCanonical(v) for v in values):
+                return None
+            return {'terms': {field: [int(v) for v in values]}}
+        if any(',' in v for v in values):
+            return None
+        query = {'regexp': {field: {'value': '(.*,)?({0})(,.*)?'.format('|'.join(map(_regexp, values)))}}}
+        return self._withMissing(field, query, 'None' in values)
+
+    def _pmatchQuery(self, field, numeric, values):
+        if numeric or not values or any(',' in v for v in values):
+            return None
+        query = {'regexp': {field: {'value': '.*({0}).*'.format('|'.join(map(_regexp, values)))}}}
+        return self._withMissing(field, query, any(v in 'None' for v in values))
+
+
+def _getField(source, field):
+    for key in field.split('.'):
+        if not isinstance(source, dict) or key not in source:
+            return None
+        source = source[key]
+    return source
+
+
+def _values(source, field):
+    value = _getField(source, field)
+    if value is None and field.endswith('.keyword'):
+        value = _getField(source, field[: -len('.keyword')])
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _clauses(clauses, occur):
+    q = clauses.get(occur, [])
+    return q if isinstance(q, list) else [q]
+
+
+def matchQuery(query: dict, source: dict) -> bool:
+    """Reference evaluation of the query DSL subset produced by SfqlEsCompiler (and used by the
+    exporter) against an indexed event, following Elasticsearch semantics on keyword fields.
+
+    :param query: an Elasticsearch query.
+    :type query: dict
+
+    :param source: the indexed event (document _source).
+    :type source: dict
+    """
+    if 'match_all' in query:
+        return True
+    if 'bool' in query:
+        clauses = query['bool']
+        required = _clauses(clauses, 'must') + _clauses(clauses, 'filter')
+        if not all(matchQuery(q, source) for q in required):
+            return False
+        if any(matchQuery(q, source) for q in _clauses(clauses, 'must_not')):
+            return False
+        should = _clauses(clauses, 'should')
+        msm = int(clauses.get('minimum_should_match', 0 if required else 1))
+        return not should or sum(1 for q in should if matchQuery(q, source)) >= msm
+    if 'exists' in query:
+        return len(_values(source, query['exists']['field'])) > 0
+    if 'term' in query:
+        ((field, value),) = query['term'].items()
+        value = value['value'] if isinstance(value, dict) else value
+        return value in _values(source, field)
+    if 'terms' in query:
+        ((field, values),) = query['terms'].items()
+        return any(v in values for v in _values(source, field))
+    if 'range' in query:
+        ((field, bounds),) = query['range'].items()
+        for v in _values(source, field):
+            if all(
+                (op != 'gt' or v > b) and (op != 'gte' or v >= b) and (op != 'lt' or v < b) and (op != 'lte' or v <= b)
+                for op, b in bounds.items()
+            ):
+                return True
+        return False
+    if 'regexp' in query:
+        ((field, spec),) = query['regexp'].items()
+        flags = re.IGNORECASE if spec.get('case_insensitive') else 0
+        pattern = re.compile(spec['value'], flags | re.DOTALL)
+        return any(pattern.fullmatch(str(v)) for v in _values(source, field))
+    raise ValueError('unsupported query {0}'.format(query))
@@ -12,7 +12,8 @@ tabulate.PRESERVE_WHITESPACE = True
 from tabulate import tabulate
 from dotty_dict import dotty
 import pandas as pd
-from sysflow.reader import NestedNamespace
+from sysflow.reader import NestedNamespace, SFReader, FlattenedSFReader
+from sysflow.records import Record
 
 """
 .. module:: sysflow.formatter
@@ -141,11 +142,15 @@ _fields = {  #   '<key>': (<columnn name>, <column width>, <description>, <query
 }
 
 
+def _int(val, default):
+    return default if val is None else int(val)
+
+
 class SFFormatter(object):
     """
     **SFFormatter**
 
-    This class takes a `FlattenedSFReader`, and exports SysFlow as either JSON, CSV or Pretty Print .
+    This class takes a `FlattenedSFReader`, or any iterable of decoded event dictionaries, and exports SysFlow as either JSON, CSV or Pretty Print .
     Example Usage::
 
         reader = FlattenedSFReader(trace, False)
@@ -161,14 +166,16 @@ class SFFormatter(object):
         elif args.output == 'str':
             formatter.toStdOut(fields=fields)
 
-    :param reader: A reader representing the sysflow file being read.
-    :type reader: sysflow.reader.FlattenedSFReader
+    :param reader: A reader representing the sysflow file being read, or an iterable of event dictionaries.
+    :type reader: sysflow.reader.FlattenedSFReader or iterable
 
     :param defs: A list of paths to filter definitions.
     :type defs: list
     """
 
     def __init__(self, reader, defs=[]):
+        if reader is not None and not isinstance(reader, SFReader):
+            reader = FlattenedSFReader(reader)
         self.reader = reader
         self.sfqlint = SfqlInterpreter()
         self.defs = defs
@@ -209,7 +216,7 @@ class SFFormatter(object):
         """
         _r = None
         data = OrderedDict()
-        for idx, r in enumerate(self.sfqlint.filter(self.reader, expr, self.defs)):
+        for idx, r in enumerate(self.sfqlint.filter(self.reader, expr, self.defs, prefilter=True)):
             _r = self._flatten(*r, fields)
             data[idx] = _r.values()
         return pd.DataFrame.from_dict(data, orient='index', columns=_r.keys() if _r else None)
@@ -227,7 +234,7 @@ class SFFormatter(object):
         :param expr: a sfql filter expression
         :type expr: str
         """
-        for r in self.sfqlint.filter(self.reader, expr, self.defs):
+        for r in self.sfqlint.filter(self.reader, expr, self.defs, prefilter=True):
             record = self._flatten(*r, fields)
             func(json.dumps(record))
 
@@ -243,7 +250,7 @@ class SFFormatter(object):
         :type expr: str
         """
         __format = self._flatten if flat else self._nest
-        recs = [__format(*r, fields) for r in self.sfqlint.filter(self.reader, expr, self.defs)]
+        recs = [__format(*r, fields) for r in self.sfqlint.filter(self.reader, expr, self.defs, prefilter=True)]
         return json.dumps(recs)
 
     def toJsonStdOut(self, fields=None, flat=False, expr=None):
@@ -258,7 +265,7 @@ class SFFormatter(object):
         :type expr: str
         """
         __format = self._flatten if flat else self._nest
-        for r in self.sfqlint.filter(self.reader, expr, self.defs):
+        for r in self.sfqlint.filter(self.reader, expr, self.defs, prefilter=True):
             record = __format(*r, fields)
             print(json.dumps(record))
 
@@ -278,7 +285,7 @@ class SFFormatter(object):
         """
         __format = self._flatten if flat else self._nest
         with open(path, mode='w') as jsonfile:
-            json.dump([__format(*r, fields) for r in self.sfqlint.filter(self.reader, expr, self.defs)], jsonfile)
+            json.dump([__format(*r, fields) for r in self.sfqlint.filter(self.reader, expr, self.defs, prefilter=True)], jsonfile)
 
     def toCsvFile(self, path, fields=None, header=True, expr=None):
         """Writes SysFlow to CSV file.
@@ -294,7 +301,7 @@ class SFFormatter(object):
         :type expr: str
         """
         with open(path, mode='w') as csv_file:
-            for idx, r in enumerate(self.sfqlint.filter(self.reader, expr, self.defs)):
+            for idx, r in enumerate(self.sfqlint.filter(self.reader, expr, self.defs, prefilter=True)):
                 record = self._flatten(*r, fields)
                 if idx == 0:
                     fieldnames = list(record.keys())
@@ -303,7 +310,7 @@ class SFFormatter(object):
                         writer.writeheader()
                 writer.writerow(record)
 
-    def toStdOut(self, fields=_default_fields, pretty_headers=True, showindex=True, expr=None):
+    def toStdOut(self, fields=_default_fields, pretty_headers=True, showindex=True, expr=None, bulksize=1000):
         """Writes SysFlow as a tabular pretty print form to stdout.
 
         :param fields: a list of the SysFlow fields to be exported in the JSON.  See
@@ -318,6 +325,9 @@ class SFFormatter(object):
 
         :param expr: a sfql filter expression
         :type expr: str
+
+        :param bulksize: number of records printed at once (1 prints records as soon as they are read, e.g., when following a log).
+        :type bulksize: int
         """
         fields = _default_fields if fields is None else fields
         headers = self._header_map() if pretty_headers else 'keys'
@@ -330,7 +340,7 @@ class SFFormatter(object):
         pw = len(sel) * 6 + 10
         wf = min((self._get_terminal_size()[0] - pw) / tw, 1.25)
 
-        for idx, r in enumerate(self.sfqlint.filter(self.reader, expr, self.defs)):
+        for idx, r in enumerate(self.sfqlint.filter(self.reader, expr, self.defs, prefilter=True)):
             record = self._flatten(*r, fields)
             if showindex:
                 record['idx'] = idx
@@ -344,7 +354,7 @@ class SFFormatter(object):
                     data = '{0: <{width}}'.format('' if value is None else value, width=w)
                 record[key] = (data[w:] and '..') + data[-w:]
             bulkRecs.append(record)
-            if idx > 0 and idx % 1000 == 0:
+            if idx % bulksize == 0 and (idx > 0 or bulksize == 1):
                 if first:
                     print(tabulate(bulkRecs, headers=headers, tablefmt='github'))
                     first = False
@@ -380,113 +390,114 @@ class SFFormatter(object):
         return columns, row
 
     def _flatten(self, objtype, head, event, host, container, pod, file, file_action, network, source, destination, process, pprocess, fields, tags=None):
+        # attributes missing from a section (e.g., projected out of an export) flatten like a missing section
         _flat_map = OrderedDict()
         _flat_map['type'] = OBJECT_MAP.get(objtype, '?')
         if objtype in [ObjectTypes.FILE_FLOW, ObjectTypes.FILE_EVT]:
-            _flat_map['res'] = file.path if file and file.path else ''
-            _flat_map['res'] += ', ' + file.newpath if file and file.newpath else ''
+            _flat_map['res'] = getattr(file, 'path', None) or ''
+            _flat_map['res'] += ', ' + file.newpath if getattr(file, 'newpath', None) else ''
         elif objtype in [ObjectTypes.NET_FLOW]:
             _flat_map['res'] = source.ip + ":" + str(source.port) + "-" + destination.ip + ":" + str(destination.port)
         else:
             _flat_map['res'] = 'None'
 
-        _flat_map['head.ts'] = head.ts if head else ''
-        _flat_map['head.endts'] = head.endts if head else ''
-        _flat_map['head.type'] = head.type if head else ''
-
-        _flat_map['event.actoin'] = event.action if event else ''
-        _flat_map['event.category'] = event.category if event else ''
-        _flat_map['event.kind'] = event.kind if event else ''
-        _flat_map['event.sf_ret'] = int(event.sf_ret) if event and hasattr(event, "sf_ret") else None
-        _flat_map['event.sf_type'] = event.sf_type if event else ''
-        _flat_map['event.type'] = event.type if event else ''
-        _flat_map['event.opflags'] = utils.getOpFlagsStr(event.opflags_int) if event else ''
-        _flat_map['event.opflags_int'] = int(event.opflags_int) if event else None
-
-        _flat_map['host.id'] = host.id if host else ''
-        _flat_map['host.ip'] = host.ip if host else ''
-
-        _flat_map['container.id'] = container.id if container else ''
-        _flat_map['container.image.id'] = container.image.id if container else ''
-        _flat_map['container.image.name'] = container.image.name if container else ''
-        _flat_map['container.name'] = container.name if container else ''
-        _flat_map['container.runtime'] = container.runtime if container else ''
-        _flat_map['container.privileged'] = container.privileged if container else ''
-
-        _flat_map['pod.ts'] = pod.ts if pod else ''
-        _flat_map['pod.id'] = pod.id if pod else ''
-        _flat_map['pod.name'] = pod.name if pod else ''
-        _flat_map['pod.namespace'] = pod.namespace if pod else ''
-        _flat_map['pod.nodename'] = pod.nodename if pod else ''
-        _flat_map['pod.hostip'] = pod.hostip if pod else ''
-        _flat_map['pod.internalip'] = pod.internalip if pod else ''
-        _flat_map['pod.restartcnt'] = int(pod.restartcnt) if pod else None
-
-        _flat_map['file.directory'] = file.directory if file else ''
-        _flat_map['file.name'] = file.name if file else ''
-        _flat_map['file.oid'] = file.oid if file else ''
-        _flat_map['file.newoid'] = file.newoid if file else ''
-        _flat_map['file.path'] = file.path if file else ''
-        _flat_map['file.type'] = file.type if file else ''
-        _flat_map['file.typechar'] = file.type if file else ''
-        _flat_map['file.newpath'] = file.newpath if file else ''
-        _flat_map['file.openflags'] = file.openflags if file else ''
-        _flat_map['file.openflags_int'] = file.openflags_int if file else ''
-        _flat_map['file.is_open_read'] = file.is_open_read if file else ''
-        _flat_map['file.is_open_write'] = file.is_open_write if file else ''
-
-        _flat_map['file_action.bytes_read'] = int(file_action.bytes_read) if file_action else None
-        _flat_map['file_action.read_ops'] = int(file_action.read_ops) if file_action else None
-        _flat_map['file_action.bytes_written'] = int(file_action.bytes_written) if file_action else None
-        _flat_map['file_action.write_ops'] = int(file_action.write_ops) if file_action else None
-        _flat_map['file_action.gap_time'] = int(file_action.gap_time) if file_action else None
-
-        _flat_map['network.rbytes'] = int(network.rbytes) if network else None
-        _flat_map['network.wbytes'] = int(network.wbytes) if network else None
-        _flat_map['network.community_id'] = network.community_id if network else ''
-        _flat_map['network.protocol'] = network.protocol if network else ''
-        _flat_map['network.iana_number'] = int(network.iana_number) if network else None
-        _flat_map['network.gap_time'] = int(network.gap_time) if network else None
-
-        _flat_map['source.bytes'] = int(source.bytes) if source else None
-        _flat_map['source.ip'] = source.ip if source else ''
-        _flat_map['source.packets'] = int(source.packets) if source else None
-        _flat_map['source.port'] = int(source.port) if source else None
-
-        _flat_map['destination.bytes'] = int(destination.bytes) if destination else None
-        _flat_map['destination.ip'] = destination.ip if destination else ''
-        _flat_map['destination.packets'] = int(destination.packets) if destination else None
-        _flat_map['destination.port'] = int(destination.port) if destination else None       
-
-        _flat_map['process.args'] = process.args if process else ''
-        _flat_map['process.command_line'] = process.command_line if process else ''
-        _flat_map['process.exe'] = process.exe if process else ''
-        _flat_map['process.name'] = process.name if process else ''
-        _flat_map['process.oldexe'] = process.oldexe if process else ''
-        _flat_map['process.oldname'] = process.oldname if process else ''
-        _flat_map['process.aname'] = process.aname if process else ''
-        _flat_map['process.tid'] = int(process.tid) if process else ''
-        _flat_map['process.start'] = process.start if process else ''
-        _flat_map['process.tty'] = process.tty if process else ''
-        _flat_map['process.oid.hpid'] = int(process.oid.hpid) if process else None
-        _flat_map['process.oid.createTS'] = int(process.oid.createTS) if process else None
-        _flat_map['process.uid'] = int(process.uid) if process else None
-        _flat_map['process.user'] = process.user if process else ''
-        _flat_map['process.gid'] = int(process.gid) if process else None
-        _flat_map['process.group'] = process.group if process else ''
-
-        _flat_map['pprocess.args'] = pprocess.args if pprocess else ''
-        _flat_map['pprocess.command_line'] = pprocess.command_line if pprocess else ''
-        _flat_map['pprocess.exe'] = pprocess.exe if pprocess else ''
-        _flat_map['pprocess.name'] = pprocess.name if pprocess else ''
-        _flat_map['pprocess.start'] = pprocess.start if pprocess else ''
-        _flat_map['pprocess.tty'] = pprocess.tty if pprocess else ''
-        _flat_map['pprocess.oid.hpid'] = int(pprocess.oid.hpid) if pprocess else None
-        _flat_map['pprocess.oid.createTS'] = int(pprocess.oid.createTS) if pprocess else None
-        _flat_map['pprocess.uid'] = int(pprocess.uid) if pprocess else None
-        _flat_map['pprocess.user'] = pprocess.user if pprocess else ''
-        _flat_map['pprocess.gid'] = int(pprocess.gid) if pprocess else None
-        _flat_map['pprocess.group'] = pprocess.group if pprocess else ''
+        _flat_map['head.ts'] = getattr(head, 'ts', '')
+        _flat_map['head.endts'] = getattr(head, 'endts', '')
+        _flat_map['head.type'] = getattr(head, 'type', '')
+
+        _flat_map['event.actoin'] = getattr(event, 'action', '')
+        _flat_map['event.category'] = getattr(event, 'category', '')
+        _flat_map['event.kind'] = getattr(event, 'kind', '')
+        _flat_map['event.sf_ret'] = _int(getattr(event, 'sf_ret', None), None)
+        _flat_map['event.sf_type'] = getattr(event, 'sf_type', '')
+        _flat_map['event.type'] = getattr(event, 'type', '')
+        _flat_map['event.opflags'] = utils.getOpFlagsStr(_int(getattr(event, 'opflags_int', None), 0)) if event else ''
+        _flat_map['event.opflags_int'] = _int(getattr(event, 'opflags_int', None), None)
+
+        _flat_map['host.id'] = getattr(host, 'id', '')
+        _flat_map['host.ip'] = getattr(host, 'ip', '')
+
+        _flat_map['container.id'] = getattr(container, 'id', '')
+        _flat_map['container.image.id'] = getattr(getattr(container, 'image', None), 'id', '')
+        _flat_map['container.image.name'] = getattr(getattr(container, 'image', None), 'name', '')
+        _flat_map['container.name'] = getattr(container, 'name', '')
+        _flat_map['container.runtime'] = getattr(container, 'runtime', '')
+        _flat_map['container.privileged'] = getattr(container, 'privileged', '')
+
+        _flat_map['pod.ts'] = getattr(pod, 'ts', '')
+        _flat_map['pod.id'] = getattr(pod, 'id', '')
+        _flat_map['pod.name'] = getattr(pod, 'name', '')
+        _flat_map['pod.namespace'] = getattr(pod, 'namespace', '')
+        _flat_map['pod.nodename'] = getattr(pod, 'nodename', '')
+        _flat_map['pod.hostip'] = getattr(pod, 'hostip', '')
+        _flat_map['pod.internalip'] = getattr(pod, 'internalip', '')
+        _flat_map['pod.restartcnt'] = _int(getattr(pod, 'restartcnt', None), None)
+
+        _flat_map['file.directory'] = getattr(file, 'directory', '')
+        _flat_map['file.name'] = getattr(file, 'name', '')
+        _flat_map['file.oid'] = getattr(file, 'oid', '')
+        _flat_map['file.newoid'] = getattr(file, 'newoid', '')
+        _flat_map['file.path'] = getattr(file, 'path', '')
+        _flat_map['file.type'] = getattr(file, 'type', '')
+        _flat_map['file.typechar'] = getattr(file, 'type', '')
+        _flat_map['file.newpath'] = getattr(file, 'newpath', '')
+        _flat_map['file.openflags'] = getattr(file, 'openflags', '')
+        _flat_map['file.openflags_int'] = getattr(file, 'openflags_int', '')
+        _flat_map['file.is_open_read'] = getattr(file, 'is_open_read', '')
+        _flat_map['file.is_open_write'] = getattr(file, 'is_open_write', '')
+
+        _flat_map['file_action.bytes_read'] = _int(getattr(file_action, 'bytes_read', None), None)
+        _flat_map['file_action.read_ops'] = _int(getattr(file_action, 'read_ops', None), None)
+        _flat_map['file_action.bytes_written'] = _int(getattr(file_action, 'bytes_written', None), None)
+        _flat_map['file_action.write_ops'] = _int(getattr(file_action, 'write_ops', None), None)
+        _flat_map['file_action.gap_time'] = _int(getattr(file_action, 'gap_time', None), None)
+
+        _flat_map['network.rbytes'] = _int(getattr(network, 'rbytes', None), None)
+        _flat_map['network.wbytes'] = _int(getattr(network, 'wbytes', None), None)
+        _flat_map['network.community_id'] = getattr(network, 'community_id', '')
+        _flat_map['network.protocol'] = getattr(network, 'protocol', '')
+        _flat_map['network.iana_number'] = _int(getattr(network, 'iana_number', None), None)
+        _flat_map['network.gap_time'] = _int(getattr(network, 'gap_time', None), None)
+
+        _flat_map['source.bytes'] = _int(getattr(source, 'bytes', None), None)
+        _flat_map['source.ip'] = getattr(source, 'ip', '')
+        _flat_map['source.packets'] = _int(getattr(source, 'packets', None), None)
+        _flat_map['source.port'] = _int(getattr(source, 'port', None), None)
+
+        _flat_map['destination.bytes'] = _int(getattr(destination, 'bytes', None), None)
+        _flat_map['destination.ip'] = getattr(destination, 'ip', '')
+        _flat_map['destination.packets'] = _int(getattr(destination, 'packets', None), None)
+        _flat_map['destination.port'] = _int(getattr(destination, 'port', None), None)       
+
+        _flat_map['process.args'] = getattr(process, 'args', '')
+        _flat_map['process.command_line'] = getattr(process, 'command_line', '')
+        _flat_map['process.exe'] = getattr(process, 'exe', '')
+        _flat_map['process.name'] = getattr(process, 'name', '')
+        _flat_map['process.oldexe'] = getattr(process, 'oldexe', '')
+        _flat_map['process.oldname'] = getattr(process, 'oldname', '')
+        _flat_map['process.aname'] = getattr(process, 'aname', '')
+        _flat_map['process.tid'] = _int(getattr(process, 'tid', None), '')
+        _flat_map['process.start'] = getattr(process, 'start', '')
+        _flat_map['process.tty'] = getattr(process, 'tty', '')
+        _flat_map['process.oid.hpid'] = _int(getattr(getattr(process, 'oid', None), 'hpid', None), None)
+        _flat_map['process.oid.createTS'] = _int(getattr(getattr(process, 'oid', None), 'createTS', None), None)
+        _flat_map['process.uid'] = _int(getattr(process, 'uid', None), None)
+        _flat_map['process.user'] = getattr(process, 'user', '')
+        _flat_map['process.gid'] = _int(getattr(process, 'gid', None), None)
+        _flat_map['process.group'] = getattr(process, 'group', '')
+
+        _flat_map['pprocess.args'] = getattr(pprocess, 'args', '')
+        _flat_map['pprocess.command_line'] = getattr(pprocess, 'command_line', '')
+        _flat_map['pprocess.exe'] = getattr(pprocess, 'exe', '')
+        _flat_map['pprocess.name'] = getattr(pprocess, 'name', '')
+        _flat_map['pprocess.start'] = getattr(pprocess, 'start', '')
+        _flat_map['pprocess.tty'] = getattr(pprocess, 'tty', '')
+        _flat_map['pprocess.oid.hpid'] = _int(getattr(getattr(pprocess, 'oid', None), 'hpid', None), None)
+        _flat_map['pprocess.oid.createTS'] = _int(getattr(getattr(pprocess, 'oid', None), 'createTS', None), None)
+        _flat_map['pprocess.uid'] = _int(getattr(pprocess, 'uid', None), None)
+        _flat_map['pprocess.user'] = getattr(pprocess, 'user', '')
+        _flat_map['pprocess.gid'] = _int(getattr(pprocess, 'gid', None), None)
+        _flat_map['pprocess.group'] = getattr(pprocess, 'group', '')
         _flat_map['tags'] = tags if tags else ()
 
         if not self.allFields and fields:
@@ -507,6 +518,8 @@ class SFFormatter(object):
     def _obj_to_dict(self, obj):
         if isinstance(obj, list):
             ret = list(map(self._obj_to_dict, obj))
+        elif isinstance(obj, Record):
+            ret = {key: self._obj_to_dict(getattr(obj, key)) for key in obj._keys()}
         elif isinstance(obj, NestedNamespace):
             ret = {key: self._obj_to_dict(getattr(obj, key)) for key in vars(obj)}
             # need to handle the special case of 'clusterIP's in the service dict in order to convert back Int to string with IP address
@@ -8,7 +8,7 @@ import sysflow.utils as utils
 import sysflow.opflags as opflags
 from sysflow.formatter import _fields, SFFormatter
 from sysflow.objtypes import ObjectTypes, OBJECT_MAP, OBJ_NAME_MAP
-from sysflow.reader import FlattenedSFReader
+from sysflow.reader import FlattenedSFReader, MergedSFReader
 from sysflow.sfql import SfqlInterpreter
 from graphviz import Digraph
 import matplotlib.pylab as plt
@@ -35,6 +35,38 @@ tqdm.__init__ = partialmethod(tqdm.__init__, disable=True)
 
 INFSYMB = '&infin;'
 
+# record fields read to key, label and link the entities of a graphlet
+REQUIRED_FIELDS = [
+    'head',
+    'event.opflags_int',
+    'container.id',
+    'process.oid',
+    'process.tid',
+    'process.exe',
+    'process.args',
+    'process.oldexe',
+    'process.oldname',
+    'process.uid',
+    'process.user',
+    'process.gid',
+    'process.group',
+    'process.tty',
+    'pprocess.oid',
+    'pprocess.exe',
+    'pprocess.args',
+    'pprocess.uid',
+    'pprocess.user',
+    'pprocess.gid',
+    'pprocess.group',
+    'pprocess.tty',
+    'file.path',
+    'file.newpath',
+    'source.ip',
+    'source.port',
+    'destination.ip',
+    'destination.port',
+]
+
 FLOW_FIELDS = [
     'head.ts',
     'head.endts',
@@ -73,7 +105,9 @@ class Graphlet(object):
     """
     **Graphlet**
 
-    This class takes a path pointing to a sysflow record or a directory containing sysflow records.
+    This class takes a path pointing to a sysflow record or a directory containing sysflow records,
+    or an iterable of decoded event dictionaries (e.g., events streamed from an exporter).
+    The records of a directory are read as a single stream, merged in head.ts order.
 
     Example Usage::
 
@@ -86,6 +120,10 @@ class Graphlet(object):
          g1 = Graphlet('data/', ioc1, ['policies/ttps.yaml'])
          g1.view()
 
+         # in-process pipeline from an exporter generator
+         g1 = Graphlet(exportEvents(), ioc1, ['policies/ttps.yaml'])
+         g1.view()
+
     :param graphlet: A compact provenance graph representation based on sysflow records.
     :type graphlet: sysflow.Graphlet
     """
@@ -96,29 +134,54 @@ class Graphlet(object):
     associated_mitigations_normalized = pd.DataFrame()
     defend_data = {}
 
-    def __init__(self, path, expr=None, defs=[]):
+    def __init__(self, path, expr=None, defs=[], cache=None):
         """Create graphlet object from raw sysflow with optional filters and policy taggers.
 
-        :param path: a path to a sysflow record or directory containing sysflow records.
-        :type path: str
+        :param path: a path to a sysflow record or directory containing sysflow records, or an iterable of event dictionaries.
+        :type path: str or iterable
 
         :param expr: sfql style filter.
         :type expr: str
 
         :param defs: a list of paths for yaml policies that enrich graph nodes.
         :type defs: list
+
+        :param cache: bounds of the reader entity caches (maxentries, ttl, exitttl; see FlattenedSFReader).
+                      Parent processes and oldexe file records evicted from the caches can no longer be
+                      resolved; such lookups are counted in cacheStats.
+        :type cache: dict
         """
-        if os.path.isfile(path):
-            self.readers = [FlattenedSFReader(path, retEntities=True)]
-        elif os.path.isdir(path):
-            self.readers = [FlattenedSFReader(f, retEntities=True) for f in _files(path)]
+        cache = cache or {}
+        if isinstance(path, (str, bytes, os.PathLike)) and os.path.isdir(path):
+            # one stream merged in time order, so that entities are resolved across files
+            self.readers = [MergedSFReader(sorted(_files(path)), retEntities=True, lazy=True, **cache)]
+        else:
+            self.readers = [FlattenedSFReader(path, retEntities=True, lazy=True, **cache)]
         self.nodes = OrderedDict()
         self.edges = set()
         self.sfqlint = SfqlInterpreter(paths=defs)
         self.fmt = SFFormatter(None)
+        self.cacheStats = dict()
         for reader in self.readers:
             self.reader = reader
             self.__create(expr)
+            self.__addCacheStats(reader.getCacheStats())
+        if any(stats['evictedMisses'] for stats in self.cacheStats.values()):
+            logger.warning(
+                'graphlet lookups missed because of cache eviction: {0}'.format(
+                    ', '.join('{0} {1}'.format(name, stats['evictedMisses']) for name, stats in self.cacheStats.items())
+                )
+            )
+
+    def __addCacheStats(self, stats):
+        for name, counters in stats.items():
+            total = self.cacheStats.setdefault(name, {'evictions': {}})
+            for key, val in counters.items():
+                if key == 'evictions':
+                    for reason, n in val.items():
+                        total['evictions'][reason] = total['evictions'].get(reason, 0) + n
+                else:
+                    total[key] = total.get(key, 0) + val
 
 
     def __create(self, expr=None):
@@ -145,9 +208,8 @@ class Graphlet(object):
                 if opflag == utils.getOpFlagsStr(opflags.OP_EXEC):
                     self.__addProcEvtEdge(opflag, process, pprocess, r, filt)
                     if process.oldexe and process.oldname:
-                        fileKey = self.reader.getFileKey(container.id, process.oldexe)
-                        if fileKey in self.reader.files:
-                            nrec = self.reader.files[fileKey]
+                        nrec = self.reader.getFile(container.id, process.oldexe)
+                        if nrec is not None:
 
                             nhead = nrec.head if hasattr(nrec, "head") else None
                             nevent = nrec.event if hasattr(nrec, "event") else None
@@ -219,9 +281,8 @@ class Graphlet(object):
         if new:
             n2_k, n2_v = self.__findNode(filt)
             if not n2_k:
-                key = self.reader.getProcessKey(pprocess.oid) if pprocess.oid else None
-                if key in self.reader.processes:
-                    pp = self.reader.processes[key]
+                pp = self.reader.getProcess(pprocess.oid) if pprocess.oid else None
+                if pp is not None:
                     n2_k = _hash((process.exe, process.args, pp.exe, pp.args))
                 else:
                     n2_k = _hash((process.exe, process.args))
@@ -258,9 +319,8 @@ class Graphlet(object):
             n2_k, n2_v = self.__findNode(filt)            
 
         if not n2_k:
-            key = self.reader.getProcessKey(pprocess.oid) if pprocess else None
-            if key in self.reader.processes:
-                pp = self.reader.processes[key]
+            pp = self.reader.getProcess(pprocess.oid) if pprocess else None
+            if pp is not None:
                 n2_k = _hash((p.exe, p.args, pp.exe, pp.args))
             else:
                 n2_k = _hash((p.exe, p.args))
@@ -285,9 +345,8 @@ class Graphlet(object):
         if new:
             n2_k, n2_v = self.__findNode(filt)
             if not n2_k:
-                key = self.reader.getProcessKey(pprocess.oid) if pprocess.oid else None
-                if key in self.reader.processes:
-                    pp = self.reader.processes[key]
+                pp = self.reader.getProcess(pprocess.oid) if pprocess.oid else None
+                if pp is not None:
                     n2_k = _hash((process.exe, process.args, pp.exe, pp.args))
                 else:
                     n2_k = _hash((process.exe, process.args))
@@ -314,9 +373,8 @@ class Graphlet(object):
         if new:
             n2_k, n2_v = self.__findNode(filt)
             if not n2_k:
-                key = self.reader.getProcessKey(pprocess.oid) if pprocess.oid else None
-                if key in self.reader.processes:
-                    pp = self.reader.processes[key]
+                pp = self.reader.getProcess(pprocess.oid) if pprocess.oid else None
+                if pp is not None:
                     n2_k = _hash((process.exe, process.args, pp.exe, pp.args))
                 else:
                     n2_k = _hash((process.exe, process.args))
@@ -1203,7 +1261,7 @@ def _escape(s):
 
 
 def _files(path):
-    """list files in dir path"""
+    """list files in dir path, skipping the sidecar indexes of MmapSFReader"""
     for file in os.listdir(path):
-        if os.path.isfile(os.path.join(path, file)):
+        if os.path.isfile(os.path.join(path, file)) and not file.endswith('.idx'):
             yield os.path.join(path, file)
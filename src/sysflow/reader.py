@@ -1,10 +1,25 @@
 #!/usr/bin/env python3
 
 import logging
+import io, os, re, mmap, struct, time
+import bz2, gzip, heapq
 import hashlib, json
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
 from sysflow.objtypes import ObjectTypes, OBJ_NAME_MAP
+from sysflow.opflags import OP_EXIT
+from sysflow.decoder import detectDecoder, getDecoder
+from sysflow.records import makeRecord, makeLazyRecord, RecordInterner
 from types import SimpleNamespace
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 class NestedNamespace(SimpleNamespace):
     @staticmethod
     def mapEntry(entry):
@@ -33,36 +48,761 @@ class NestedNamespace(SimpleNamespace):
 def hashDeal(o):
     return int(hashlib.md5(json.dumps(o).encode('utf-8')).hexdigest(), 16)
 
+
+# magic bytes of the compressed log formats read transparently
+COMPRESSIONS = {b'\x1f\x8b': 'gzip', b'BZh': 'bz2', b'\x28\xb5\x2f\xfd': 'zstd'}
+
+
+def detectCompression(filename):
+    """Returns the compression of a log from its magic bytes.
+
+    :param filename: the path to the log.
+    :type filename: str
+
+    :rtype: str
+    :return: the compression name (see COMPRESSIONS), or None for uncompressed logs.
+    """
+    with open(filename, 'rb') as f:
+        magic = f.read(4)
+    for prefix, name in COMPRESSIONS.items():
+        if magic.startswith(prefix):
+            return name
+    return None
+
+
+def openLog(filename, bufsize=io.DEFAULT_BUFFER_SIZE, compression=None):
+    """Opens a log for reading text lines, decompressing it on the fly if needed.
+
+    :param filename: the path to the log.
+    :type filename: str
+
+    :param bufsize: size in bytes of the read buffer.
+    :type bufsize: int
+
+    :param compression: the compression of the log (see detectCompression).
+    :type compression: str
+
+    :rtype: io.TextIOBase
+    :return: the text stream of the log.
+    """
+    if compression is None:
+        return open(filename, 'r', encoding='utf-8', buffering=bufsize)
+    if compression == 'gzip':
+        raw = gzip.open(filename, 'rb')
+    elif compression == 'bz2':
+        raw = bz2.open(filename, 'rb')
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise Exception('Reading zstd compressed logs requires the zstandard package')
+        raw = zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'), read_across_frames=True, closefd=True)
+    else:
+        raise Exception('Unknown log compression {0}'.format(compression))
+    return io.TextIOWrapper(io.BufferedReader(raw, buffer_size=bufsize), encoding='utf-8')
+
+
+# seconds between checks for new lines at the end of a followed log
+FOLLOW_INTERVAL = 1.0
+
+
+class LogFollower(object):
+    """
+    **LogFollower**
+
+    Iterator over the lines of a growing log, like ``tail -F``: at the end of the log, it polls
+    for new lines every interval seconds instead of stopping, so it never ends until closed.
+
+    - Rotation (the path now names another file): the old file is drained, then the path is reopened.
+    - Truncation (the file became shorter than the read position): reading starts over from the top.
+    - Partially written lines are held back until their newline is written.
+
+    :param filename: the path to the log.
+    :type filename: str
+
+    :param bufsize: size in bytes of the read buffer.
+    :type bufsize: int
+
+    :param interval: seconds between checks for new lines.
+    :type interval: float
+    """
+
+    def __init__(self, filename, bufsize=io.DEFAULT_BUFFER_SIZE, interval=FOLLOW_INTERVAL):
+        self.filename = filename
+        self.bufsize = bufsize
+        self.interval = interval
+        self.fh = open(filename, 'rb', buffering=bufsize)
+        self.partial = b''
+        self.rotated = False
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self.closed:
+            line = self.fh.readline()
+            if line.endswith(b'\n'):
+                if self.partial:
+                    line = self.partial + line
+                    self.partial = b''
+                return line.decode('utf-8')
+            if line:
+                self.partial += line
+            elif not self.check():
+                time.sleep(self.interval)
+        raise StopIteration
+
+    def check(self):
+        """Checks the log for rotation and truncation at the end of the file.
+
+        :rtype: bool
+        :return: True if reading should resume right away.
+        """
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            # rotated away, and not recreated yet
+            return False
+        current = os.fstat(self.fh.fileno())
+        if (stat.st_ino, stat.st_dev) != (current.st_ino, current.st_dev):
+            if not self.rotated:
+                # lines may have been appended to the old file since the last read
+                self.rotated = True
+                return True
+            self.fh.close()
+            self.fh = open(self.filename, 'rb', buffering=self.bufsize)
+            self.partial = b''
+            self.rotated = False
+            return True
+        if stat.st_size < self.fh.tell():
+            self.fh.seek(0)
+            self.partial = b''
+            return True
+        return False
+
+    def close(self):
+        self.closed = True
+        self.fh.close()
+
+
+# number of evicted keys remembered by an EntityCache, to tell misses caused by eviction apart
+GHOST_ENTRIES = 1 << 16
+
+
+class EntityCache(object):
+    """
+    **EntityCache**
+
+    Dictionary-like cache of the entities (processes, files, containers, pods) seen by a
+    FlattenedSFReader, with optional bounds. Entries are kept in least-recently-used order;
+    setting or looking up an entry makes it the most recent one.
+
+    - maxentries: once the cache holds more entries, the least recently used one is evicted.
+    - ttl: entries that were not touched for ttl nanoseconds of event time (head.ts, see
+      advance()) are evicted. Expiry scans from the least recently used end, so it assumes
+      events are read roughly in head.ts order.
+    - expire(): evicts an entry at a given event time, e.g., a process some time after it exited.
+
+    Evictions are counted by reason ('lru', 'ttl', 'exit'). The keys of the last GHOST_ENTRIES
+    evicted entries are remembered, so that lookups through get() that miss because the entry
+    was evicted are counted separately (evictedMisses) from entries that were never seen.
+
+    :param maxentries: maximum number of entries (None: unbounded).
+    :type maxentries: int
+
+    :param ttl: time to live of idle entries, in nanoseconds of event time (None: no expiry).
+    :type ttl: int
+    """
+
+    def __init__(self, maxentries=None, ttl=None):
+        self.maxentries = maxentries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.stamps = dict()
+        self.exits = deque()
+        self.ghosts = OrderedDict()
+        self.now = 0
+        self.peak = 0
+        self.evictions = {'lru': 0, 'ttl': 0, 'exit': 0}
+        self.lookups = 0
+        self.misses = 0
+        self.evictedMisses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __getitem__(self, key):
+        val = self.entries[key]
+        self.entries.move_to_end(key)
+        if self.ttl is not None:
+            self.stamps[key] = self.now
+        return val
+
+    def __setitem__(self, key, val):
+        entries = self.entries
+        entries[key] = val
+        entries.move_to_end(key)
+        if self.ttl is not None:
+            self.stamps[key] = self.now
+        if self.ghosts:
+            self.ghosts.pop(key, None)
+        if len(entries) > self.peak:
+            self.peak = len(entries)
+            if self.maxentries is not None and self.peak > self.maxentries:
+                self.peak = self.maxentries
+                self.evict(next(iter(entries)), 'lru')
+
+    def get(self, key, default=None):
+        """Looks up an entry, counting misses and misses caused by eviction.
+
+        :param key: the entry key.
+
+        :param default: the value returned when the key is not cached.
+
+        :return: the cached entity, or default.
+        """
+        self.lookups += 1
+        if key in self.entries:
+            return self[key]
+        self.misses += 1
+        if key in self.ghosts:
+            self.evictedMisses += 1
+        return default
+
+    def keys(self):
+        return self.entries.keys()
+
+    def values(self):
+        return self.entries.values()
+
+    def items(self):
+        return self.entries.items()
+
+    def evict(self, key, reason):
+        """Removes an entry from the cache, counting its eviction under reason."""
+        del self.entries[key]
+        self.stamps.pop(key, None)
+        self.evictions[reason] += 1
+        self.ghosts[key] = None
+        if len(self.ghosts) > GHOST_ENTRIES:
+            self.ghosts.popitem(last=False)
+
+    def expire(self, key, ts):
+        """Schedules the eviction of an entry once event time reaches ts (see advance()).
+
+        :param key: the entry key.
+
+        :param ts: the event time (nanoseconds) at which the entry is evicted.
+        :type ts: int
+        """
+        self.exits.append((ts, key))
+
+    def advance(self, ts):
+        """Moves the event time of the cache to ts, evicting expired entries.
+
+        :param ts: the head.ts of the current event.
+        :type ts: int
+        """
+        if ts < self.now:
+            return
+        self.now = ts
+        exits = self.exits
+        while exits and exits[0][0] <= ts:
+            _, key = exits.popleft()
+            if key in self.entries:
+                self.evict(key, 'exit')
+        if self.ttl is not None:
+            entries = self.entries
+            stamps = self.stamps
+            limit = ts - self.ttl
+            while entries:
+                key = next(iter(entries))
+                if stamps[key] >= limit:
+                    break
+                self.evict(key, 'ttl')
+
+    def stats(self):
+        """Returns the size and eviction counters of the cache.
+
+        :rtype: dict
+        :return: entries, peak entries, evictions by reason, lookups, misses and misses caused by eviction.
+        """
+        return {
+            'entries': len(self.entries),
+            'peak': self.peak,
+            'evictions': dict(self.evictions),
+            'lookups': self.lookups,
+            'misses': self.misses,
+            'evictedMisses': self.evictedMisses,
+        }
+
 class SFReader(object):
-    def __init__(self, filename):
+    """
+    **SFReader**
+
+    This class streams sysflow records from an exported events log, one line at a time.
+    Lines are pulled lazily from the file handle, so memory use does not depend on the
+    size of the log. Instead of a path, it also accepts any iterable of decoded event
+    dictionaries (e.g., the generator returned by an exporter), which is consumed lazily
+    as well.
+
+    Logs compressed with gzip, bz2 or zstd (detected from their magic bytes) are decompressed
+    while they are read.
+
+    :param filename: the path to the events log, or an iterable of event dictionaries.
+    :type filename: str or iterable
+
+    :param bufsize: size in bytes of the read buffer used on the file handle.
+    :type bufsize: int
+
+    :param decoder: the record decoder, either a name from sysflow.decoder.DECODERS or a decoder object.
+                    By default, the format (JSON-Lines or legacy python repr) is detected from the first line.
+    :type decoder: str or sysflow.decoder.SFDecoder
+
+    :param lazy: return lazy records, whose attributes are built from the decoded event on first access
+                 (see sysflow.records.LazyRecord); this speeds up scans where most records are
+                 rejected by a filter that only reads a few attributes.
+    :type lazy: bool
+
+    :param dedup: share identical container, pod and process sections across records and intern
+                  their strings (see sysflow.records.RecordInterner).
+    :type dedup: bool
+
+    :param follow: keep reading records as they are appended to the log, across rotation and
+                   truncation (see LogFollower); iteration then never ends until the reader is
+                   closed. Compressed logs cannot be followed.
+    :type follow: bool
+
+    :param interval: seconds between checks for new records in follow mode.
+    :type interval: float
+    """
+
+    lazy = False
+    prefilter = None
+    interner = None
+    compression = None
+    follow = False
+
+    def __init__(self, filename, bufsize=io.DEFAULT_BUFFER_SIZE, decoder=None, lazy=False, dedup=False, follow=False, interval=FOLLOW_INTERVAL):
+        self.lazy = lazy
+        self.follow = follow
+        if dedup:
+            self.interner = RecordInterner(lazy)
+        if not isinstance(filename, (str, bytes, os.PathLike)):
+            self.filename = None
+            self.fh = None
+            self.rdr = iter(filename)
+            self.decoder = getDecoder(decoder or 'dict')
+            return
         self.filename = filename
-        self.fh = open(filename, "r", encoding="utf-8")
-        self.rdr = iter(self.fh.readlines())
+        self.compression = detectCompression(filename)
+        if follow:
+            if self.compression:
+                raise Exception('Compressed logs cannot be followed: {0}'.format(filename))
+            self.fh = LogFollower(filename, bufsize, interval)
+            self.rdr = iter(self.fh)
+            if decoder:
+                self.decoder = getDecoder(decoder)
+            else:
+                # peek at the first line without waiting for it; new logs default to JSON-Lines
+                with open(filename, 'r', encoding='utf-8') as f:
+                    self.decoder = detectDecoder(f.readline())
+            return
+        self.fh = openLog(filename, bufsize, self.compression)
+        self.rdr = iter(self.fh)
+        if decoder:
+            self.decoder = getDecoder(decoder)
+        else:
+            first = self.fh.readline()
+            self.decoder = detectDecoder(first)
+            self.rdr = chain([first], self.fh) if first else self.rdr
 
     def __iter__(self):
         return self
 
+    def setPrefilter(self, prefilter):
+        """Skips the raw lines rejected by prefilter before they are decoded.
+
+        :param prefilter: a test on undecoded lines, such as the sfql.LinePrefilter of a query.
+        :type prefilter: callable
+        """
+        self.prefilter = prefilter
+        if self.fh:
+            self.rdr = filter(prefilter, self.rdr)
+
     def next(self):
-        record = eval(next(self.rdr))
+        return self.makeRecord(self.decoder.decode(next(self.rdr)))
+
+    def makeRecord(self, record):
+        """Returns the object type and the record object of a decoded event dictionary."""
         name = record["event"]["sf_type"]
-        o = NestedNamespace(**record)
+        if self.interner:
+            record = self.interner(record)
+        o = makeLazyRecord(record) if self.lazy else makeRecord(record)
         return OBJ_NAME_MAP[name], o
 
     def __next__(self):
         return self.next()
 
     def close(self):
+        if self.fh:
+            self.fh.close()
+
+
+# sidecar index layout: header (magic, log size, log mtime in ns, record count),
+# followed by the head.ts values and the line offsets of the records, sorted by head.ts
+_INDEX_MAGIC = b'SFIDX001'
+_INDEX_HEADER = struct.Struct('<8sQQQ')
+_HEAD_TS = re.compile(rb"""['"]head['"]\s*:\s*\{[^{}]*?['"]ts['"]\s*:\s*(-?\d+)""")
+
+
+class MmapSFReader(SFReader):
+    """
+    **MmapSFReader**
+
+    This class reads sysflow records from an exported events log through a memory map,
+    for repeated access to time slices of the same log. The first time a log is opened,
+    the line offsets and head.ts values of its records are indexed and saved to a sidecar
+    file (<filename>.idx); later readers load the index instead of scanning the log. The
+    index is rebuilt whenever the size or modification time of the log changes.
+
+    Records are returned in head.ts order (the order of the log, for logs exported sorted),
+    and only the lines that are actually read are decoded.
+
+    Example Usage::
+
+         reader = MmapSFReader('data/events.log')
+         for objtype, rec in reader.read_range(1677845126000000000, 1677845127000000000):
+             print(objtype, rec.process.exe)
+
+    :param filename: the path to the events log.
+    :type filename: str
+
+    :param decoder: the record decoder, either a name from sysflow.decoder.DECODERS or a decoder object.
+                    By default, the format is detected from the first line.
+    :type decoder: str or sysflow.decoder.SFDecoder
+
+    :param indexpath: the path of the sidecar index (default: <filename>.idx).
+    :type indexpath: str
+    """
+
+    def __init__(self, filename, decoder=None, indexpath=None):
+        self.filename = filename
+        self.indexpath = indexpath or filename + '.idx'
+        if detectCompression(filename):
+            raise Exception('Compressed logs cannot be memory-mapped: {0}'.format(filename))
+        self.fh = open(filename, 'rb')
+        stat = os.fstat(self.fh.fileno())
+        self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else None
+        first = self.mm.readline().decode('utf-8') if self.mm else ''
+        self.decoder = getDecoder(decoder) if decoder else detectDecoder(first)
+        if not self.loadIndex(stat):
+            self.buildIndex()
+            self.saveIndex(stat)
+        self.pos = 0
+
+    def loadIndex(self, stat):
+        """Loads the sidecar index, if it exists and matches the size and mtime of the log.
+
+        :rtype: bool
+        :return: True if the index was loaded.
+        """
+        try:
+            with open(self.indexpath, 'rb') as f:
+                magic, size, mtime, count = _INDEX_HEADER.unpack(f.read(_INDEX_HEADER.size))
+                if magic != _INDEX_MAGIC or size != stat.st_size or mtime != stat.st_mtime_ns:
+                    return False
+                self.ts = array('q')
+                self.offsets = array('Q')
+                self.ts.fromfile(f, count)
+                self.offsets.fromfile(f, count)
+                return True
+        except (OSError, EOFError, struct.error):
+            return False
+
+    def buildIndex(self):
+        """Scans the log, indexing the line offset and head.ts of each record."""
+        entries = []
+        mm = self.mm
+        size = len(mm) if mm else 0
+        pos = 0
+        while pos < size:
+            end = mm.find(b'\n', pos)
+            end = size if end < 0 else end
+            line = mm[pos:end]
+            if line.strip():
+                m = _HEAD_TS.search(line)
+                ts = int(m.group(1)) if m else self.decoder.decode(line.decode('utf-8'))['head']['ts']
+                entries.append((ts, pos))
+            pos = end + 1
+        entries.sort()
+        self.ts = array('q', (e[0] for e in entries))
+        self.offsets = array('Q', (e[1] for e in entries))
+
+    def saveIndex(self, stat):
+        """Writes the index next to the log; a read-only location only costs a rescan next time."""
+        try:
+            with open(self.indexpath + '.tmp', 'wb') as f:
+                f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, len(self.ts)))
+                self.ts.tofile(f)
+                self.offsets.tofile(f)
+            os.replace(self.indexpath + '.tmp', self.indexpath)
+        except OSError as e:
+            logging.warning('Unable to save index {0}: {1}'.format(self.indexpath, e))
+
+    def __len__(self):
+        return len(self.ts)
+
+    def seek(self, ts):
+        """Positions the reader on the first record with head.ts >= ts.
+
+        :param ts: a timestamp in nanoseconds.
+        :type ts: int
+        """
+        self.pos = bisect_left(self.ts, ts)
+
+    def getLine(self, idx):
+        """Returns the undecoded line of the record at position idx of the index."""
+        start = self.offsets[idx]
+        end = self.mm.find(b'\n', start)
+        return self.mm[start:end if end >= 0 else len(self.mm)].decode('utf-8')
+
+    def read(self, idx):
+        """Decodes the record at position idx of the index.
+
+        :rtype: tuple
+        :return: the object type and the record.
+        """
+        return self.makeRecord(self.decoder.decode(self.getLine(idx)))
+
+    def setPrefilter(self, prefilter):
+        self.prefilter = prefilter
+
+    def records(self, start, stop):
+        """Yields the records at positions start to stop - 1 of the index that pass the prefilter."""
+        prefilter = self.prefilter
+        for idx in range(start, stop):
+            line = self.getLine(idx)
+            if prefilter is None or prefilter(line):
+                yield self.makeRecord(self.decoder.decode(line))
+
+    def read_range(self, t0, t1):
+        """Yields the records with t0 <= head.ts <= t1, decoding only the lines in the slice.
+
+        :param t0: start timestamp in nanoseconds.
+        :type t0: int
+
+        :param t1: end timestamp in nanoseconds.
+        :type t1: int
+        """
+        return self.records(bisect_left(self.ts, t0), bisect_right(self.ts, t1))
+
+    def next(self):
+        while self.pos < len(self.ts):
+            self.pos += 1
+            if self.prefilter is None:
+                return self.read(self.pos - 1)
+            line = self.getLine(self.pos - 1)
+            if self.prefilter(line):
+                return self.makeRecord(self.decoder.decode(line))
+        raise StopIteration
+
+    def close(self):
+        if self.mm:
+            self.mm.close()
         self.fh.close()
 
 
+# default size in bytes of the log chunks decoded by each worker task
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def getChunks(filename, chunksize=CHUNK_SIZE):
+    """Splits a log into newline-aligned byte ranges of about chunksize bytes.
+
+    :rtype: list
+    :return: a list of (start, end) byte offsets.
+    """
+    chunks = []
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        start = 0
+        while start < size:
+            f.seek(min(start + chunksize, size))
+            f.readline()
+            end = min(f.tell(), size)
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def getTextChunks(lines, chunksize=CHUNK_SIZE):
+    """Groups the lines of a log stream into blocks of about chunksize characters, for logs
+    that cannot be split by byte offsets (e.g., compressed logs).
+
+    :rtype: generator
+    :return: the text blocks, in log order.
+    """
+    chunk = []
+    size = 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if size >= chunksize:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield ''.join(chunk)
+
+
+def decodeChunk(filename, start, end, decoder, prefilter=None):
+    """Decodes the records in the byte range [start, end) of a log; runs in the worker processes.
+
+    Plain dictionaries are returned, since they cross the process boundary much faster than
+    record objects; the parent builds the record objects from them.
+
+    :rtype: list
+    :return: the decoded event dictionaries of the chunk, in log order.
+    """
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8')
+    return decodeText(text, decoder, prefilter)
+
+
+def decodeText(text, decoder, prefilter=None):
+    """Decodes the records in a block of log lines; runs in the worker processes.
+
+    :rtype: list
+    :return: the decoded event dictionaries of the block, in log order.
+    """
+    lines = text.split('\n')
+    if not lines[-1]:
+        lines.pop()
+    if prefilter:
+        lines = filter(prefilter, lines)
+    return list(map(decoder.decode, lines))
+
+
 class FlattenedSFReader(SFReader):
-    def __init__(self, filename, retEntities=False):
-        super().__init__(filename)
-        self.processes = dict()
-        self.files = dict()
-        self.containers = dict()
-        self.pods = dict()
+    """
+    **FlattenedSFReader**
+
+    This class reads sysflow records as flattened tuples, keeping caches of the processes,
+    files, containers and pods seen so far.
+
+    With workers > 1, the log is split into newline-aligned chunks that are decoded by a
+    pool of worker processes; batches are consumed in log order, so records (and the state
+    of the caches) are identical to the serial reader. Only a bounded number of chunks is
+    in flight at any time. Parallel decoding applies to log paths; iterables of event
+    dictionaries are always read serially. Compressed logs cannot be split by byte offsets,
+    so they are decompressed by the calling process, which hands blocks of lines to the workers.
+
+    Workers take the text decoding off the calling process, while record objects are still
+    built by the parent; parallel decoding pays off for formats that are expensive to decode,
+    such as legacy repr logs. For JSON-Lines logs with a fast JSON backend, passing decoded
+    events between processes costs about as much as decoding them in place.
+
+    :param filename: the path to the events log, or an iterable of event dictionaries.
+    :type filename: str or iterable
+
+    :param workers: number of decoding processes (1: decode in the calling process).
+    :type workers: int
+
+    :param chunksize: approximate size in bytes of the chunks handed to workers.
+    :type chunksize: int
+
+    :param lazy: return lazy records (see SFReader).
+    :type lazy: bool
+
+    :param dedup: share identical entity sections across records (see SFReader); on by default,
+                  since the reader keeps the entities in its caches anyway.
+    :type dedup: bool
+
+    The entity caches are unbounded by default. For long or never-ending streams, they can
+    be bounded (see EntityCache); lookups through getProcess() and getFile() that miss because
+    an entity was evicted are reported by getCacheStats().
+
+    :param maxentries: maximum number of entries of each entity cache, evicted in LRU order (None: unbounded).
+    :type maxentries: int
+
+    :param ttl: evict entities not seen for ttl nanoseconds of event time (head.ts) (None: no expiry).
+    :type ttl: int
+
+    :param exitttl: evict processes exitttl nanoseconds of event time after their exit (OP_EXIT) event (None: keep).
+    :type exitttl: int
+
+    :param follow: follow the log as it grows (see SFReader); followed logs are always decoded by the
+                   calling process, and bounded entity caches keep memory in check over time.
+    :type follow: bool
+
+    :param interval: seconds between checks for new records in follow mode.
+    :type interval: float
+    """
+
+    def __init__(self, filename, retEntities=False, bufsize=io.DEFAULT_BUFFER_SIZE, decoder=None, workers=1, chunksize=CHUNK_SIZE, lazy=False,
+                 maxentries=None, ttl=None, exitttl=None, dedup=True, follow=False, interval=FOLLOW_INTERVAL):
+        super().__init__(filename, bufsize, decoder, lazy, follow=follow, interval=interval)
+        if dedup:
+            self.interner = RecordInterner(lazy, maxentries)
+        self.processes = EntityCache(maxentries, ttl)
+        self.files = EntityCache(maxentries, ttl)
+        self.containers = EntityCache(maxentries, ttl)
+        self.pods = EntityCache(maxentries, ttl)
+        self.exitttl = exitttl
+        self.timed = ttl is not None or exitttl is not None
         self.retEntities = retEntities
+        self.pool = None
+        if workers > 1 and self.fh and not follow:
+            self.pool = ProcessPoolExecutor(max_workers=workers)
+            self.batches = self.getBatches(self.getTasks(chunksize), 2 * workers)
+
+    def getTasks(self, chunksize):
+        """Yields the decoding tasks of the log, as arguments to the worker pool."""
+        if self.compression:
+            # the line stream is decompressed here, and already prefiltered (see setPrefilter)
+            for text in getTextChunks(self.rdr, chunksize):
+                yield (decodeText, text, self.decoder)
+        else:
+            for start, end in getChunks(self.filename, chunksize):
+                yield (decodeChunk, self.filename, start, end, self.decoder, self.prefilter)
+
+    def getBatches(self, tasks, inflight):
+        """Yields the records decoded by the worker pool, in log order."""
+        tasks = iter(tasks)
+        futures = deque()
+        try:
+            for task in tasks:
+                futures.append(self.pool.submit(*task))
+                if len(futures) >= inflight:
+                    break
+            while futures:
+                batch = futures.popleft().result()
+                for task in tasks:
+                    futures.append(self.pool.submit(*task))
+                    break
+                for record in batch:
+                    yield self.makeRecord(record)
+        finally:
+            for future in futures:
+                future.cancel()
+            self.pool.shutdown(wait=False)
+
+    def next(self):
+        if self.pool:
+            return next(self.batches)
+        return super().next()
+
+    def close(self):
+        if self.pool:
+            self.batches.close()
+        super().close()
 
     def getProcess(self, oid):
         """Returns a Process Object given a process object id.
@@ -73,30 +813,47 @@ class FlattenedSFReader(SFReader):
         :rtype: sysflow.entity.Process
         :return: the desired process object or None if no process object is available.
         """
-        key = self.getProcessKey(oid)
-        if key in self.processes:
-            return self.processes[key]
-        else:
-            return None
+        return self.processes.get(self.getProcessKey(oid))
+
+    def getFile(self, cid, path):
+        """Returns the last record on a file given its container id and path.
+
+        :param cid: the container id.
+        :type cid: str
+
+        :param path: the file path.
+        :type path: str
+
+        :rtype: sysflow.records.Record
+        :return: the last record that referenced the file or None if the file is not cached.
+        """
+        return self.files.get(self.getFileKey(cid, path))
+
+    def getCacheStats(self):
+        """Returns the size and eviction counters of the entity caches (see EntityCache.stats()).
+
+        :rtype: dict
+        :return: the counters of each cache, by cache name.
+        """
+        return {name: cache.stats() for name, cache in (('processes', self.processes), ('files', self.files), ('containers', self.containers), ('pods', self.pods))}
 
     def getProcessKey(self, oid):
-        hpid = oid.hpid
-        createTS = oid.createTS
-        key = hpid.to_bytes((hpid.bit_length() + 7) // 8, byteorder='little')
-        key += createTS.to_bytes((createTS.bit_length() + 7) // 8, byteorder='little')
-        return key
-    
+        """Returns the process cache key of a process object id: the (hpid, createTS) tuple."""
+        return (oid.hpid, oid.createTS)
+
     def getFileKey(self, cid, path):
-        key = hashDeal(cid + path)
-        return key
+        """Returns the file cache key of a file path in a container: the (cid, path) tuple."""
+        return (cid, path)
 
     def __next__(self):
         while True:
-            objtype, rec = super().next()
+            objtype, rec = self.next()
             pod = None
             container = None
             file = None
 
+            if self.timed:
+                self.advance(rec)
             if hasattr(rec, "pod"):
                 key = rec.pod.id
                 pod = rec.pod
@@ -132,3 +889,72 @@ class FlattenedSFReader(SFReader):
             source = rec.source if hasattr(rec, "source") else None
             destination = rec.destination if hasattr(rec, "destination") else None
             return (objtype, head, event, host, container, pod, file, file_action, network, source, destination, process, pprocess)
+
+    def advance(self, rec):
+        """Moves the entity caches to the event time of rec, and schedules the eviction of exiting processes."""
+        head = getattr(rec, 'head', None)
+        if head is None:
+            return
+        ts = head.ts
+        for cache in (self.processes, self.files, self.containers, self.pods):
+            cache.advance(ts)
+        if self.exitttl is not None and head.type == 'PE' and getattr(rec.event, 'opflags_int', 0) & OP_EXIT:
+            # thread exits leave the process running
+            process = rec.process
+            if process.tid == process.oid.hpid:
+                self.processes.expire(self.getProcessKey(process.oid), ts + self.exitttl)
+
+
+def _headTs(event):
+    return event['head']['ts']
+
+
+class MergedSFReader(FlattenedSFReader):
+    """
+    **MergedSFReader**
+
+    This class reads sysflow records from several events logs as a single flattened stream,
+    merged in head.ts order, e.g., the logs of a directory split by time or by exporter.
+    The merge is a streaming k-way merge on a heap: only the next record of each log is held
+    in memory, and every log is expected to be sorted by head.ts itself. Records with equal
+    timestamps are returned in the order of the logs. All logs share the entity caches of the
+    reader, so parent processes and files can be resolved across logs.
+
+    Example Usage::
+
+         reader = MergedSFReader(sorted(glob.glob('data/*.log')))
+         for objtype, head, event, host, container, pod, file, file_action, network, source, destination, process, pprocess in reader:
+             print(head.ts, process.exe)
+
+    :param filenames: the paths to the events logs (plain or compressed).
+    :type filenames: list
+
+    :param decoder: the record decoder of the logs (default: detected for each log).
+    :type decoder: str or sysflow.decoder.SFDecoder
+
+    The remaining parameters are those of FlattenedSFReader; logs are always decoded by the
+    calling process.
+    """
+
+    def __init__(self, filenames, retEntities=False, bufsize=io.DEFAULT_BUFFER_SIZE, decoder=None, lazy=False,
+                 maxentries=None, ttl=None, exitttl=None, dedup=True):
+        self.readers = [SFReader(f, bufsize, decoder) for f in filenames]
+        events = heapq.merge(*[self.getEvents(r) for r in self.readers], key=_headTs)
+        super().__init__(events, retEntities, bufsize, 'dict', lazy=lazy, maxentries=maxentries, ttl=ttl, exitttl=exitttl, dedup=dedup)
+
+    @staticmethod
+    def getEvents(reader):
+        """Yields the decoded events of a log; lines are read when the merge first needs them,
+        so prefilters set on the reader apply."""
+        decode = reader.decoder.decode
+        for line in reader.rdr:
+            yield decode(line)
+
+    def setPrefilter(self, prefilter):
+        self.prefilter = prefilter
+        for reader in self.readers:
+            reader.setPrefilter(prefilter)
+
+    def close(self):
+        for reader in self.readers:
+            reader.close()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+import sys
+from itertools import chain
+
+"""
+.. module:: sysflow.records
+   :synopsis: Compact record types for the sections of exported sysflow events.
+.. moduleauthor:: Frederico Araujo, Teryl Taylor
+"""
+
+# known keys of each record section, by dotted path from the event root
+SCHEMA = {
+    '': ['timestamp', 'head', 'event', 'host', 'container', 'pod', 'file', 'file_action', 'network', 'source', 'destination', 'process', 'pprocess'],
+    'head': ['ts', 'endts', 'type'],
+    'event': ['action', 'category', 'duration', 'end', 'kind', 'opflags', 'opflags_int', 'sf_ret', 'sf_type', 'start', 'type'],
+    'host': ['id', 'ip'],
+    'container': ['id', 'name', 'image', 'runtime', 'privileged', 'containerport', 'hostport', 'mountdest', 'mountmode', 'mountpropagation', 'mountsource'],
+    'container.image': ['id', 'name', 'repo'],
+    'pod': ['ts', 'id', 'name', 'namespace', 'nodename', 'hostip', 'internalip', 'restartcnt', 'services'],
+    'file': ['path', 'name', 'directory', 'type', 'typechar', 'oid', 'newoid', 'newpath', 'target_path', 'openflags', 'openflags_int', 'is_open_read', 'is_open_write'],
+    'file_action': ['bytes_read', 'bytes_written', 'read_ops', 'write_ops', 'duration', 'gap_time'],
+    'network': ['community_id', 'protocol', 'iana_number', 'rbytes', 'wbytes', 'duration', 'gap_time'],
+    'source': ['ip', 'port', 'bytes', 'packets', 'operations'],
+    'destination': ['ip', 'port', 'bytes', 'packets', 'operations'],
+    'process': ['oid', 'exe', 'name', 'args', 'command_line', 'aname', 'oldexe', 'oldname', 'tid', 'start', 'tty', 'uid', 'user', 'gid', 'group'],
+    'process.oid': ['hpid', 'createTS'],
+    'pprocess': ['oid', 'exe', 'name', 'args', 'command_line', 'aname', 'oldexe', 'oldname', 'tid', 'start', 'tty', 'uid', 'user', 'gid', 'group'],
+    'pprocess.oid': ['hpid', 'createTS'],
+}
+
+
+class Record(object):
+    """
+    **Record**
+
+    Base class of the record section types. Keys listed in the SCHEMA of a section are
+    stored in ``__slots__``; any other key falls back to a per-instance ``__dict__``, which
+    is only allocated when such a key is set. Unset keys raise ``AttributeError`` like
+    missing attributes of a namespace, so ``hasattr`` and ``getattr`` with a default keep
+    working. Plain ``Record`` instances hold sections that are not in the SCHEMA.
+    """
+
+    __slots__ = ('__dict__',)
+    _fields = ()
+    _types = {}
+
+    def __init__(self, **kwargs):
+        for key, val in kwargs.items():
+            setattr(self, key, _value(self._types.get(key, Record), val, makeRecord))
+
+    def _keys(self):
+        """Returns the keys set on the record, in slot order then insertion order."""
+        return [k for k in self._fields if hasattr(self, k)] + list(self.__dict__)
+
+    def _asdict(self):
+        """Returns the record as a dictionary of its set keys (sub-records are not converted)."""
+        return {k: getattr(self, k) for k in self._keys()}
+
+    def __eq__(self, other):
+        if not isinstance(other, Record):
+            return NotImplemented
+        return self._asdict() == other._asdict()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{0}({1})'.format(type(self).__name__, ', '.join('{0}={1!r}'.format(k, v) for k, v in self._asdict().items()))
+
+
+class LazyRecord(Record):
+    """
+    **LazyRecord**
+
+    Record whose keys are materialized on first access from the decoded dictionary it
+    wraps; nested sections become lazy records themselves. Building one costs a single
+    allocation, so records that are rejected by a filter after touching a few attributes
+    never pay for the sections they did not read. Missing keys raise ``AttributeError``.
+    """
+
+    __slots__ = ('_raw',)
+
+    def __getattr__(self, key):
+        if key == '_raw':
+            raise AttributeError(key)
+        try:
+            val = self._raw[key]
+        except KeyError:
+            raise AttributeError(key) from None
+        if val.__class__ in _CONTAINERS:
+            val = _value(self._types.get(key, LazyRecord), val, _wrap)
+        _setattr(self, key, val)
+        return val
+
+    def _keys(self):
+        keys = [k for k in self._fields if k in self._raw]
+        return keys + [k for k in chain(self._raw, self.__dict__) if k not in keys]
+
+
+def _typeName(path):
+    return ''.join(p.capitalize() for p in path.replace('_', '.').split('.')) + 'Record' if path else 'SFRecord'
+
+
+def _makeTypes(schema, lazy=False):
+    types = {}
+    for path in sorted(schema, key=lambda p: -len(p.split('.')) if p else 0):
+        children = {k: types[path + '.' + k if path else k] for k in schema[path] if (path + '.' + k if path else k) in types}
+        attrs = {'__slots__': tuple(schema[path]), '_fields': tuple(schema[path]), '_types': children}
+        bases = (Record,)
+        if lazy and path:
+            attrs.update(__slots__=('_raw',), __getattr__=LazyRecord.__getattr__, _keys=LazyRecord._keys)
+            bases = (TYPES[path],)
+        elif lazy:
+            # the event root stays eager, so testing which sections an event has is cheap
+            attrs['__slots__'] = ()
+            bases = (TYPES[path],)
+        types[path] = type(('Lazy' if lazy else '') + _typeName(path), bases, attrs)
+    return types
+
+
+TYPES = _makeTypes(SCHEMA)
+LAZY_TYPES = _makeTypes(SCHEMA, lazy=True)
+SFRecord = TYPES['']
+LazySFRecord = LAZY_TYPES['']
+
+_new = object.__new__
+_setattr = setattr
+
+
+def _value(cls, val, build):
+    t = val.__class__
+    if t is dict:
+        return build(val, cls)
+    default = LazyRecord if build is _wrap else Record
+    if t is list:
+        return [build(e, default) if e.__class__ is dict else e for e in val]
+    if t is tuple:
+        if len(val) == 2:
+            return build(val[1], default) if val[1].__class__ is dict else val[1]
+        return tuple(build(e, default) if e.__class__ is dict else e for e in val)
+    return val
+
+
+def makeRecord(d, cls=SFRecord):
+    """Builds a record object of type cls from a decoded event (or section) dictionary.
+
+    Nested dictionaries become records of the section types in SCHEMA, or plain Record
+    objects for unknown sections.
+
+    :param d: the decoded dictionary.
+    :type d: dict
+
+    :param cls: the record type.
+    :type cls: type
+
+    :rtype: sysflow.records.Record
+    :return: the record object.
+    """
+    o = _new(cls)
+    types = cls._types
+    for key, val in d.items():
+        if val.__class__ in _CONTAINERS:
+            val = _value(types.get(key, Record), val, makeRecord)
+        _setattr(o, key, val)
+    return o
+
+
+def _wrap(d, cls):
+    o = _new(cls)
+    o._raw = d
+    return o
+
+
+def makeLazyRecord(d, cls=LazySFRecord):
+    """Builds a lazy record of type cls from a decoded event dictionary: the top-level
+    keys are set right away, while each section is only built on first access.
+
+    :param d: the decoded dictionary.
+    :type d: dict
+
+    :param cls: the record type.
+    :type cls: type
+
+    :rtype: sysflow.records.Record
+    :return: the record object.
+    """
+    o = _new(cls)
+    types = cls._types
+    for key, val in d.items():
+        if val.__class__ in _CONTAINERS:
+            val = _value(types.get(key, LazyRecord), val, _wrap)
+        _setattr(o, key, val)
+    return o
+
+
+_CONTAINERS = frozenset([dict, list, tuple])
+
+
+# entity sections shared across records, with the function computing the entity key of a section
+ENTITY_KEYS = {
+    'container': lambda d: d.get('id'),
+    'pod': lambda d: d.get('id'),
+    'process': lambda d: _oidKey(d.get('oid')),
+    'pprocess': lambda d: _oidKey(d.get('oid')),
+}
+
+
+def _oidKey(oid):
+    return (oid.get('hpid'), oid.get('createTS')) if oid.__class__ is dict else oid
+
+
+def _intern(d):
+    for key, val in d.items():
+        t = val.__class__
+        if t is str:
+            d[key] = sys.intern(val)
+        elif t is dict:
+            _intern(val)
+        elif t is list:
+            d[key] = [sys.intern(e) if e.__class__ is str else e for e in val]
+
+
+class RecordInterner(object):
+    """
+    **RecordInterner**
+
+    Shares the entity sections (see ENTITY_KEYS) of decoded events across records: the
+    section object built for a container with a given id, a pod, or a process with a given
+    (hpid, createTS), is reused by every later event carrying an identical section, and the
+    strings of each new section are interned. Memory for long traces then grows with the
+    number of distinct entities rather than the number of events.
+
+    Sections are only shared when they are equal to the cached one (e.g., the tid or exe of
+    a process may change between events), so records are unchanged. The last section of
+    each entity is kept; with maxentries, the oldest entities are dropped beyond that many
+    per section.
+
+    :param lazy: build lazy section records (see makeLazyRecord).
+    :type lazy: bool
+
+    :param maxentries: maximum number of entities kept per section (None: unbounded).
+    :type maxentries: int
+    """
+
+    def __init__(self, lazy=False, maxentries=None):
+        self.types = LAZY_TYPES if lazy else TYPES
+        self.build = _wrap if lazy else makeRecord
+        self.maxentries = maxentries
+        self.sections = {name: dict() for name in ENTITY_KEYS}
+        self.shared = 0
+
+    def __call__(self, d):
+        """Returns a shallow copy of the event dictionary d, with its entity sections replaced by section records.
+
+        :param d: the decoded event dictionary.
+        :type d: dict
+
+        :rtype: dict
+        :return: the event dictionary to build the record from.
+        """
+        d = dict(d)
+        for name, entityKey in ENTITY_KEYS.items():
+            section = d.get(name)
+            if section.__class__ is not dict:
+                continue
+            key = entityKey(section)
+            cache = self.sections[name]
+            entry = cache.get(key)
+            if entry is not None and entry[0] == section:
+                d[name] = entry[1]
+                self.shared += 1
+                continue
+            _intern(section)
+            o = self.build(section, self.types[name])
+            cache[key] = (section, o)
+            if self.maxentries is not None and len(cache) > self.maxentries:
+                del cache[next(iter(cache))]
+            d[name] = o
+        return d
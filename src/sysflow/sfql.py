@@ -1,13 +1,11 @@
 #!/usr/bin/env python3
 
-import os
+import hashlib, json, logging, os, re
 from functools import reduce, partial
 from typing import Callable, Generic, TypeVar
 from frozendict import frozendict
-from antlr4 import CommonTokenStream, FileStream, InputStream, ParseTreeWalker
-from sysflow.grammar.sfqlLexer import sfqlLexer
-from sysflow.grammar.sfqlListener import sfqlListener
-from sysflow.grammar.sfqlParser import sfqlParser
+from sysflow.sfqlparse import SfqlDescentParser
+from sysflow import __version__
 from sysflow.objtypes import ObjectTypes, OBJECT_MAP
 import sysflow.utils as utils
 
@@ -19,8 +17,113 @@ import sysflow.utils as utils
 
 T = TypeVar('T')
 
+# version of the intermediate representation of parsed sfql definitions (see SfqlInterpreter.load);
+# part of the key of the compiled-policy cache, so bump it whenever the representation changes
+SFQL_IR_VERSION = 1
 
-class SfqlInterpreter(sfqlListener, Generic[T]):
+# default directory of the compiled-policy cache (see SfqlInterpreter.parseFile)
+SFQL_CACHE_DIR = os.environ.get(
+    'SFQL_CACHE_DIR', os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'sysflow', 'sfql')
+)
+
+# modules whose code produces the parsed definitions; their sources key the compiled-policy cache
+# of source checkouts, whose package version does not change with the code
+_PARSER_MODULES = ('sfql.py', 'sfqlparse.py', 'sfqlantlr.py', os.path.join('grammar', 'sfqlParser.py'))
+
+_codeVersion = None
+
+
+def _getCodeVersion():
+    """Returns the version of the sfql parsers: the package version if installed, or else a hash of their sources."""
+    global _codeVersion
+    if _codeVersion is None:
+        if __version__:
+            _codeVersion = __version__
+        else:
+            digest = hashlib.sha256()
+            for module in _PARSER_MODULES:
+                with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module), 'rb') as f:
+                    digest.update(f.read())
+            _codeVersion = digest.hexdigest()
+    return _codeVersion
+
+
+def _freeze(o):
+    """Turns the lists of definitions loaded from JSON back into tuples."""
+    return tuple(_freeze(e) for e in o) if isinstance(o, list) else o
+
+
+def substringSearch(values) -> Callable[[str], object]:
+    """Compile strings into a single search over the trie of their characters: the returned
+    function finds whether a string contains any of the values, and returns a match object
+    or None like re.search. The regular expression engine follows one trie branch per
+    character from each position, so the cost of a search depends on the length of the
+    string and of the values, but not on how many values there are.
+
+    :param values: the strings to look for.
+    :type values: iterable
+
+    :rtype: function
+    :return: the search function.
+    """
+    trie = {}
+    for value in values:
+        node = trie
+        for c in value:
+            node = node.setdefault(c, {})
+        node[''] = None
+    return re.compile(_trieRegex(trie)).search
+
+
+def _trieRegex(node: dict) -> str:
+    alternatives = [re.escape(c) + _trieRegex(child) for c, child in sorted(node.items()) if c]
+    if not alternatives:
+        return ''
+    regex = alternatives[0] if len(alternatives) == 1 else '(?:{0})'.format('|'.join(alternatives))
+    # a value ending at this node makes the rest of the branch optional
+    return '(?:{0})?'.format(regex) if '' in node else regex
+
+
+def mergeContains(terms: tuple, mapper) -> list:
+    """Returns the terms of a resolved disjunction (see SfqlInterpreter.resolveExpression), where
+    each run of adjacent 'contains' tests of literals on the same attribute becomes a single
+    pmatch term. The attribute is then read once instead of once per test, which reads the
+    same value, so predicates keep their results and exceptions.
+
+    :param terms: the terms of the disjunction.
+    :type terms: tuple
+
+    :param mapper: the attribute mapper of the interpreter.
+    :type mapper: sysflow.sfql.SfqlMapper
+
+    :rtype: list
+    :return: the merged terms.
+    """
+    merged, run = [], []
+    for term in tuple(terms) + (None,):
+        while term and term[0] == 'and' and len(term[1]) == 1:
+            term = term[1][0]
+        if term and term[0] == 'op' and term[1] == 'CONTAINS' and not mapper.hasAttr(term[3]):
+            if run and run[0][2] != term[2]:
+                merged.append(_pmatchRun(run, mapper))
+                run = []
+            run.append(term)
+            continue
+        if run:
+            merged.append(_pmatchRun(run, mapper))
+            run = []
+        if term:
+            merged.append(term)
+    return merged
+
+
+def _pmatchRun(run: list, mapper) -> tuple:
+    if len(run) == 1:
+        return run[0]
+    return ('pmatch', run[0][2], tuple(str(mapper.getAttr(None, term[3])) for term in run))
+
+
+class SfqlInterpreter(Generic[T]):
     """
     **SfqlInterpreter**
 
@@ -44,8 +147,26 @@ class SfqlInterpreter(sfqlListener, Generic[T]):
     _macros = {}
     _lists = {}
     _criteria = None
-
-    def __init__(self, query: str = None, paths: list = [], inputs: list = []):
+    _queryTree = None
+    _attributes = set()
+    _queryAttributes = frozenset()
+    _prefilter = None
+    _ruleIndex = None
+    _backend = 'codegen'
+    _parser = 'antlr'
+
+    # predicate backends: nested closures built while visiting the parse tree, or python
+    # source generated from the parse tree and compiled once (see SfqlCodeGenerator)
+    BACKENDS = ('closure', 'codegen')
+
+    # sfql parsers: the ANTLR parser generated from sfql.g4 (sysflow.sfqlantlr, imported on first
+    # use), or the hand-written recursive descent parser of sysflow.sfqlparse; both produce the
+    # same definitions (see load)
+    PARSERS = ('antlr', 'descent')
+
+    def __init__(
+        self, query: str = None, paths: list = [], inputs: list = [], backend: str = 'codegen', cache: str = SFQL_CACHE_DIR, parser: str = 'antlr'
+    ):
         """Create a sfql interpreter and optionally pre-compiles input expressions.
 
         :param query: sfql query.
@@ -56,9 +177,26 @@ class SfqlInterpreter(sfqlListener, Generic[T]):
 
         :param inputs: a list of input streams from where to read sfql list and macro definitions.
         :type inputs: list
+
+        :param backend: the predicate backend, 'codegen' (default) or 'closure' (see BACKENDS).
+        :type backend: str
+
+        :param cache: directory of the compiled-policy cache (see parseFile), or None to always parse definitions files.
+        :type cache: str
+
+        :param parser: the sfql parser, 'antlr' (default) or 'descent' (see PARSERS).
+        :type parser: str
         """
         super().__init__()
+        if backend not in self.BACKENDS:
+            raise Exception('Unknown sfql backend {0}'.format(backend))
+        if parser not in self.PARSERS:
+            raise Exception('Unknown sfql parser {0}'.format(parser))
+        self._backend = backend
+        self._parser = parser
+        self.cache = cache
         self.mapper = SfqlMapper()
+        self.codegen = SfqlCodeGenerator(self.mapper)
         self.compile(query, paths, inputs)
 
     def compile(self, query: str = None, paths: list = [], inputs: list = []):
@@ -73,17 +211,102 @@ class SfqlInterpreter(sfqlListener, Generic[T]):
         :param inputs: a list of input streams from where to read sfql list and macro definitions.
         :type inputs: list
         """
-        inputs.extend([FileStream(f) for f in paths])
-        if query:
-            input_stream = InputStream('- sfql: ' + query)
-            inputs.append(input_stream)
-        walker = ParseTreeWalker()
         for input_stream in filter(None, inputs):
-            lexer = sfqlLexer(input_stream)
-            stream = CommonTokenStream(lexer)
-            parser = sfqlParser(stream)
-            tree = parser.definitions()
-            walker.walk(self, tree)
+            self.load(self.parse(input_stream))
+        for path in paths:
+            self.load(self.parseFile(path))
+        if query:
+            self.load(self.parse('- sfql: ' + query))
+
+    def parse(self, source) -> list:
+        """Parse sfql definitions into their intermediate representation (see load).
+
+        The descent parser raises an exception on the first syntax error, while the ANTLR
+        parser reports errors and recovers from them.
+
+        :param source: sfql lists, macros, rules and query, as a string or an input stream.
+        :type source: str or antlr4.InputStream
+
+        :rtype: list
+        :return: the parsed definitions, in order.
+        """
+        if self._parser == 'descent':
+            self._syntaxErrors = 0
+            return SfqlDescentParser().parse(source if isinstance(source, str) else source.strdata)
+        from sysflow.sfqlantlr import SfqlAntlrParser
+
+        parser = SfqlAntlrParser()
+        definitions = parser.parse(source)
+        self._syntaxErrors = parser.syntaxErrors
+        return definitions
+
+    def parseFile(self, path: str) -> list:
+        """Parse the sfql definitions file at path into their intermediate representation (see load).
+
+        With a cache directory, definitions are saved there as JSON, keyed by a hash of the file
+        contents, of the representation version (SFQL_IR_VERSION) and of the package version (or of
+        the parser sources in a source checkout), and later interpreters load them from the cache
+        instead of parsing the file again. Files with syntax errors are not cached, so their errors
+        are reported on every parse.
+
+        :param path: the path to a file containing sfql definitions.
+        :type path: str
+
+        :rtype: list
+        :return: the parsed definitions, in order.
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        if not self.cache:
+            return self.parse(data.decode('ascii'))
+        key = hashlib.sha256('{0}:{1}\n'.format(SFQL_IR_VERSION, _getCodeVersion()).encode('utf-8') + data).hexdigest()
+        entry = os.path.join(self.cache, key + '.json')
+        definitions = self._loadCached(entry)
+        if definitions is None:
+            definitions = self.parse(data.decode('ascii'))
+            if not self._syntaxErrors:
+                self._saveCached(entry, path, definitions)
+        return definitions
+
+    @staticmethod
+    def _loadCached(entry: str):
+        try:
+            with open(entry, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached['version'] != SFQL_IR_VERSION:
+                return None
+            return _freeze(cached['definitions'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    @staticmethod
+    def _saveCached(entry: str, path: str, definitions: list):
+        """Writes definitions to the cache; a read-only cache only costs a parse next time."""
+        tmp = '{0}.{1}.tmp'.format(entry, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'version': SFQL_IR_VERSION, 'path': path, 'definitions': definitions}, f)
+            os.replace(tmp, entry)
+        except OSError as e:
+            logging.warning('Unable to save compiled policy {0}: {1}'.format(entry, e))
+
+    def load(self, definitions: list):
+        """Define parsed sfql lists, macros, rules and query, in order.
+
+        Definitions are tuples ('list', name, items), ('macro', name, expression),
+        ('rule', name, desc, expression, actions, priority, tags) and ('query', expression),
+        where expressions are trees as described in resolveExpression, with two more nodes:
+        ('var', name) references a macro, and the values of 'in' and 'pmatch' nodes may name lists.
+        Macro references and lists are resolved as each definition is loaded.
+
+        :param definitions: the parsed definitions (see parse and parseFile).
+        :type definitions: list
+        """
+        for definition in definitions:
+            getattr(self, self._definers[definition[0]])(*definition[1:])
+
+    _definers = {'list': '_defineList', 'macro': '_defineMacro', 'rule': '_defineRule', 'query': '_defineQuery'}
 
     def evaluate(self, t: T, query: str = None, paths: list = []) -> bool:
         """Evaluate sfql expression against flattened sysflow record t.
@@ -104,8 +327,9 @@ class SfqlInterpreter(sfqlListener, Generic[T]):
             return True
         return self._criteria(t)
 
-    def filter(self, reader, query: str = None, paths: list = []):
-        """Filter iterable reader according to sfql expression.
+    def filter(self, reader, query: str = None, paths: list = [], prefilter: bool = False):
+        """Filter iterable reader according to sfql expression. Records are filtered lazily,
+        so readers that never end (e.g., following a log) can be filtered as they grow.
 
         :param reader: sysflow reader
         :type reader: FlattenedSFReader
@@ -115,17 +339,30 @@ class SfqlInterpreter(sfqlListener, Generic[T]):
 
         :param paths: a list of paths to file containing sfql list and macro definitions.
         :type paths: list
+
+        :param prefilter: skip raw lines that cannot match the query before they are decoded (see getQueryPrefilter).
+                          Records are identical, but skipped lines never reach the entity caches of the reader.
+        :type prefilter: bool
         """
         if query:
             self.compile(query, paths)
         if not self._criteria:
             return reader
+        if prefilter and self._prefilter and hasattr(reader, 'setPrefilter'):
+            reader.setPrefilter(self._prefilter.match)
         return filter(lambda t: self._criteria(t), reader)
 
     def enrich(self, t: T):
-        """Process flattened sysflow record t based on policies."""
+        """Process flattened sysflow record t based on policies.
+
+        Only the rules the rule index selects for t are evaluated (see RuleIndex); the other
+        rules cannot match t.
+        """
+        index = SfqlInterpreter._ruleIndex
+        if index is None:
+            index = SfqlInterpreter._ruleIndex = RuleIndex(self._rules.values(), self.mapper, self._compileTree)
         tags = ()  # ([], set(), 0))
-        for n, r in self._rules.items():
+        for r in index.candidates(t):
             if r.criteria(t):
                 t0 = tags[0] if tags else []
                 t1 = tags[1] if tags else set()
@@ -137,24 +374,39 @@ class SfqlInterpreter(sfqlListener, Generic[T]):
         """Return list of attributes supported by sfql."""
         return dict(self.mapper._mapper)
 
-    def exitF_query(self, ctx: sfqlParser.F_queryContext):
-        self._criteria = self.visitExpression(ctx.expression())
-
-    def exitF_rule(self, ctx: sfqlParser.F_ruleContext):
-        self._rules[ctx.text(0).getText()] = Rule(
-            ctx.text(0).getText(),
-            ctx.text(1).getText(),
-            self.visitExpression(ctx.expression()),
-            self._getItems(ctx.items(0).getText()),
-            ctx.SEVERITY().getText(),
-            self._getItems(ctx.items(1).getText()),
-        )
+    def getQueryAttributes(self):
+        """Return the set of sfql attributes referenced by the compiled query."""
+        return self._queryAttributes
+
+    def getQueryPrefilter(self):
+        """Return the raw-line prefilter derived from the compiled query, or None if the query has no usable literals."""
+        return self._prefilter
+
+    def getPolicyAttributes(self):
+        """Return the set of sfql attributes referenced by the compiled policy rules."""
+        return frozenset().union(*[r.attributes for r in self._rules.values()])
+
+    def _defineQuery(self, tree: tuple):
+        self._attributes = set()
+        self._queryTree = self.resolveExpression(tree)
+        self._criteria = self._compileTree(self._queryTree, 'query')
+        self._queryAttributes = frozenset(self._attributes)
+        alternatives = self._prefilterExpression(self._queryTree)
+        self._prefilter = LinePrefilter(alternatives) if alternatives else None
 
-    def exitF_macro(self, ctx: sfqlParser.F_macroContext):
-        self._macros[ctx.ID().getText()] = ctx.expression()
+    def _defineRule(self, name: str, desc: str, tree: tuple, actions: tuple, priority: str, tags: tuple):
+        self._attributes = set()
+        resolved = self.resolveExpression(tree)
+        criteria = self._compileTree(resolved, name)
+        self._rules[name] = Rule(name, desc, criteria, list(actions), priority, list(tags), frozenset(self._attributes), resolved)
+        # rules are shared by all interpreters, and so is their index
+        SfqlInterpreter._ruleIndex = None
 
-    def exitF_list(self, ctx: sfqlParser.F_listContext):
-        self._lists[ctx.ID().getText()] = [item.getText().strip('\"') for item in ctx.items().atom()]
+    def _defineMacro(self, name: str, tree: tuple):
+        self._macros[name] = tree
+
+    def _defineList(self, name: str, items: tuple):
+        self._lists[name] = list(items)
 
     def _all(self, preds: Callable[[T], bool]):
         return lambda t: all(p(t) for p in preds)
@@ -165,81 +417,102 @@ class SfqlInterpreter(sfqlListener, Generic[T]):
     def _getAttr(self, t: T, attr: str):
         return self.mapper.getAttr(t, attr)
 
+    def _useAttr(self, attr: str):
+        if self.mapper.hasAttr(attr):
+            self._attributes.add(attr)
+
     def _evalPred(self, t: T, lop: str, pred: Callable[[str], bool]):
         return any(pred(s) for s in str(self._getAttr(t, lop)).split(','))
 
-    def visitExpression(self, ctx: sfqlParser.ExpressionContext) -> Callable[[T], bool]:
-        or_expression = ctx.getChild(0)
-        or_preds = []
-        if or_expression.getChildCount() > 0:
-            for and_expression in or_expression.getChildren():
-                if and_expression.getChildCount() > 0:
-                    and_preds = []
-                    for term in and_expression.getChildren():
-                        if isinstance(term, sfqlParser.TermContext):
-                            and_preds.append(self.visitTerm(term))
-                    or_preds.append(self._all(and_preds))
-        return self._any(or_preds)
-
-    def visitTerm(self, ctx: sfqlParser.TermContext) -> Callable[[T], bool]:
-        if ctx.var():
-            var = ctx.var().getText()
-            if var in self._macros:
-                return self.visitExpression(self._macros[var])
-            else:
-                raise Exception('SFQL error: unrecognized reference {0}'.format(var))
-        elif ctx.NOT():
-            return lambda t: not self.visitTerm(ctx.getChild(1))(t)
-        elif ctx.unary_operator():
-            lop = ctx.getChild(0).getText()
-            if ctx.unary_operator().EXISTS():
-                return lambda t: not not self._getAttr(t, lop)
-            else:
-                raise Exception('SFQL syntax error: unrecognized term {0}'.format(ctx.getText()))
-        elif ctx.binary_operator():
-            lop = ctx.atom(0).getText()
-            rop = lambda t: self.mapper.getAttr(t, ctx.atom(1).getText())
-            if ctx.binary_operator().CONTAINS():
+    def _buildClosure(self, tree: tuple) -> Callable[[T], bool]:
+        kind = tree[0]
+        if kind == 'or':
+            return self._any([self._buildClosure(t) for t in mergeContains(tree[1], self.mapper)])
+        elif kind == 'and':
+            return self._all([self._buildClosure(t) for t in tree[1]])
+        elif kind == 'not':
+            pred = self._buildClosure(tree[1])
+            return lambda t: not pred(t)
+        elif kind == 'exists':
+            lop = tree[1]
+            return lambda t: not not self._getAttr(t, lop)
+        elif kind == 'op':
+            op, lop, ratom = tree[1:]
+            rop = lambda t: self.mapper.getAttr(t, ratom)
+            if op == 'CONTAINS':
                 return lambda t: self._evalPred(t, lop, lambda s: str(rop(t)) in s)
-            elif ctx.binary_operator().ICONTAINS():
+            elif op == 'ICONTAINS':
                 return lambda t: self._evalPred(t, lop, lambda s: str(rop(t)).lower() in s.lower())
-            elif ctx.binary_operator().STARTSWITH():
+            elif op == 'STARTSWITH':
                 return lambda t: self._evalPred(t, lop, lambda s: s.startswith(str(rop(t))))
-            elif ctx.binary_operator().EQ():
+            elif op == 'EQ':
                 return lambda t: self._evalPred(t, lop, lambda s: s == str(rop(t)))
-            elif ctx.binary_operator().NEQ():
+            elif op == 'NEQ':
                 return lambda t: self._evalPred(t, lop, lambda s: s != str(rop(t)))
-            elif ctx.binary_operator().GT():
+            elif op == 'GT':
                 return lambda t: self._evalPred(t, lop, lambda s: int(s) > int(rop(t)))
-            elif ctx.binary_operator().GE():
+            elif op == 'GE':
                 return lambda t: self._evalPred(t, lop, lambda s: int(s) >= int(rop(t)))
-            elif ctx.binary_operator().LT():
+            elif op == 'LT':
                 return lambda t: self._evalPred(t, lop, lambda s: int(s) < int(rop(t)))
-            elif ctx.binary_operator().LE():
+            elif op == 'LE':
                 return lambda t: self._evalPred(t, lop, lambda s: int(s) >= int(rop(t)))
-            else:
-                raise Exception('SFQL syntax error: unrecognized term {0}'.format(ctx.getText()))
-        elif ctx.expression():
-            return self.visitExpression(ctx.expression())
-        elif ctx.IN():
-            lop = ctx.atom(0).getText()
-            rop = self._getList(ctx)
+        elif kind == 'in':
+            lop, rop = tree[1], frozenset(tree[2])
             return lambda t: self._evalPred(t, lop, lambda s: s in rop)
-        elif ctx.PMATCH():
-            lop = ctx.atom(0).getText()
-            rop = self._getList(ctx)
-            return lambda t: any(self._evalPred(t, lop, lambda s: e in s) for e in rop)
-        else:
-            raise Exception('SFQL syntax error: unrecognized term {0}'.format(ctx.getText()))
-        return lambda t: False
-
-    def _getItems(self, l: str) -> list:
-        return l[1:-1].split(',')
-
-    def _getList(self, ctx: sfqlParser.TermContext) -> list:
+        elif kind == 'pmatch':
+            lop = tree[1]
+            if not tree[2]:
+                # nothing is read when there is no value to match
+                return lambda t: False
+            search = substringSearch(tree[2])
+            return lambda t: self._evalPred(t, lop, lambda s: search(s) is not None)
+        raise Exception('SFQL syntax error: unrecognized term {0}'.format(tree))
+
+    def _compileTree(self, tree: tuple, name: str) -> Callable[[T], bool]:
+        if self._backend == 'codegen':
+            return self.codegen.compile(tree, name)
+        return self._buildClosure(tree)
+
+    def resolveExpression(self, tree: tuple) -> tuple:
+        """Return expression tree with macro references expanded and lists resolved, which is the
+        intermediate representation both backends compile predicates from.
+
+        Nodes are ('or', terms), ('and', terms), ('not', term), ('exists', lop), ('op', operator, lop, rop),
+        ('in', lop, values) and ('pmatch', lop, values), where operator is the token name of a binary
+        operator (e.g., 'EQ') and lop and rop are atoms as written in the query.
+
+        :param tree: a parsed expression (see load).
+        :type tree: tuple
+
+        :rtype: tuple
+        :return: the resolved expression.
+        """
+        kind = tree[0]
+        if kind in ('or', 'and'):
+            return (kind, tuple(self.resolveExpression(t) for t in tree[1]))
+        elif kind == 'var':
+            if tree[1] in self._macros:
+                return self.resolveExpression(self._macros[tree[1]])
+            raise Exception('SFQL error: unrecognized reference {0}'.format(tree[1]))
+        elif kind == 'not':
+            return ('not', self.resolveExpression(tree[1]))
+        elif kind == 'exists':
+            self._useAttr(tree[1])
+            return tree
+        elif kind == 'op':
+            self._useAttr(tree[2])
+            self._useAttr(tree[3])
+            return tree
+        elif kind in ('in', 'pmatch'):
+            self._useAttr(tree[1])
+            return (kind, tree[1], tuple(self._getList(tree[2])))
+        raise Exception('SFQL error: unknown expression node {0}'.format(kind))
+
+    def _getList(self, items: tuple) -> list:
         lst = []
-        for item in ctx.atom()[1:]:
-            lst.extend(self._reduceList(item.getText().strip('\"')))
+        for item in items:
+            lst.extend(self._reduceList(item))
         return lst
 
     def _reduceList(self, l: str) -> list:
@@ -251,6 +524,51 @@ class SfqlInterpreter(sfqlListener, Generic[T]):
             lst.append(l)
         return lst
 
+    def _prefilterExpression(self, tree: tuple):
+        """Returns the literals a raw line must contain to possibly match resolved expression tree, as a
+        list of alternatives (sets of literals that must all occur), or None for no constraint."""
+        alternatives = []
+        for and_expression in tree[1]:
+            conjunction = [frozenset()]
+            for term in and_expression[1]:
+                conjunction = self._prefilterAnd(conjunction, self._prefilterTerm(term))
+            if conjunction is None or frozenset() in conjunction:
+                return None
+            alternatives.extend(conjunction)
+        return list(dict.fromkeys(alternatives)) or None
+
+    def _prefilterAnd(self, left, right):
+        if right is None:
+            return left
+        product = [l | r for l in left for r in right]
+        if len(product) > LinePrefilter.MAX_ALTERNATIVES:
+            # keep one side only: requiring fewer literals is still conservative
+            return left if len(left) <= len(right) and frozenset() not in left else right
+        return product
+
+    def _prefilterTerm(self, tree: tuple):
+        kind = tree[0]
+        if kind == 'or':
+            return self._prefilterExpression(tree)
+        elif kind == 'op':
+            op, lop, ratom = tree[1:]
+            if op not in ('EQ', 'CONTAINS', 'STARTSWITH') or self.mapper.hasAttr(ratom):
+                return None
+            return self._prefilterLiterals(lop, [ratom.strip('\"')])
+        elif kind in ('in', 'pmatch'):
+            return self._prefilterLiterals(tree[1], list(tree[2]))
+        # not, exists and ordering comparisons constrain no literal
+        return None
+
+    def _prefilterLiterals(self, lop: str, values: list):
+        """Returns one alternative per value, if each value must occur verbatim in the raw line
+        of a record whose attribute lop matches it."""
+        if not self.mapper.isVerbatim(lop) or not values:
+            return None
+        if not all(LinePrefilter.isSafe(v) for v in values):
+            return None
+        return [frozenset([v]) for v in values]
+
 
 class SfqlMapper(Generic[T]):
 
@@ -462,12 +780,38 @@ class SfqlMapper(Generic[T]):
         'pprocess.group': partial(_getParentAttr.__func__, attr='group'),
     }
 
+    # record fields read to compute attributes that do not map one-to-one to a record field
+    _sources = {
+        'event.opflags': ['event.opflags_int'],
+        'file.path': ['file.path', 'file.type', 'file.directory'],
+        'file.openflags': ['file.openflags_int'],
+        'file_action.gap_time': ['file_action.write_time'],
+    }
+
+    # attributes whose string value may not appear in the raw record line: values computed
+    # from flag bits and lists (rendered as python lists); booleans, None and numbers are
+    # rendered by the decoder and excluded by value in LinePrefilter.isSafe
+    _computed = frozenset([
+        'event.opflags',
+        'file.openflags',
+        'process.aname',
+    ])
+
     def __init__(self):
         super().__init__()
 
     def hasAttr(self, attr: str):
         return attr in self._mapper
 
+    def isVerbatim(self, attr: str):
+        """Return True if the string value of attribute attr is copied from a single record field,
+        so that any part of it also appears in the raw (JSON or repr) line of the record."""
+        return self.hasAttr(attr) and attr not in self._computed
+
+    def getSourceFields(self, attr: str):
+        """Return the list of record fields read to compute attribute attr."""
+        return self._sources.get(attr, [attr])
+
     def getAttr(self, t: T, attr: str):
         if self.hasAttr(attr):
             return self._mapper[attr](t)
@@ -475,14 +819,357 @@ class SfqlMapper(Generic[T]):
             return attr.strip('\"')
 
 
+class SfqlCodeGenerator(object):
+    """
+    **SfqlCodeGenerator**
+
+    This class turns the intermediate representation of a sfql expression (see
+    SfqlInterpreter.resolveExpression) into the source of a flat python function over
+    flattened records, and compiles it once. Attribute accesses of the mapper are inlined
+    as expressions on the record tuple, and constants (literals, value sets, parsed
+    numbers, patterns) are hoisted into closure variables, so evaluating a predicate
+    takes a single python call instead of a tree of nested closures.
+
+    Predicates have the exact semantics of the closure backend: attribute values are
+    compared as strings split on commas, any piece may match, attributes are read in the
+    same order, and the same exceptions are raised (e.g., for missing record fields).
+    The generated source is kept on the function, as its source attribute.
+
+    :param mapper: the attribute mapper of the interpreter.
+    :type mapper: sysflow.sfql.SfqlMapper
+    """
+
+    # position of the sections read by the mapper accessors in flattened records
+    _sections = {
+        SfqlMapper._getHeadAttr: 1,
+        SfqlMapper._getEventAttr: 2,
+        SfqlMapper._getHostAttr: 3,
+        SfqlMapper._getContainerAttr: 4,
+        SfqlMapper._getPodAttr: 5,
+        SfqlMapper._getFileAttr: 6,
+        SfqlMapper._getFileActionAttr: 7,
+        SfqlMapper._getNetworkAttr: 8,
+        SfqlMapper._getSourceAttr: 9,
+        SfqlMapper._getDestinationAttr: 10,
+        SfqlMapper._getProcessAttr: 11,
+        SfqlMapper._getParentAttr: 12,
+    }
+
+    # comparisons of the closure backend on a piece s of the attribute value and the value r
+    # of the right operand (LE is evaluated as >=, like the closure backend does)
+    _comparisons = {
+        'EQ': '{s} == {r}',
+        'NEQ': '{s} != {r}',
+        'CONTAINS': '{r} in {s}',
+        'ICONTAINS': '{r}.lower() in {s}.lower()',
+        'STARTSWITH': '{s}.startswith({r})',
+        'GT': 'int({s}) > int({r})',
+        'GE': 'int({s}) >= int({r})',
+        'LT': 'int({s}) < int({r})',
+        'LE': 'int({s}) >= int({r})',
+    }
+
+    _orderings = {'GT': '>', 'GE': '>=', 'LT': '<', 'LE': '>='}
+
+    _globals = {
+        '_join': ','.join,
+        '_getOpFlags': utils.getOpFlags,
+        '_getOpenFlags': utils.getOpenFlags,
+    }
+
+    def __init__(self, mapper):
+        self.mapper = mapper
+        # bits of the flag bitmaps setting each flag name, so flag tests skip building the string of names
+        self.flags = {
+            (2, 'opflags'): ('opflags_int', self._flagMasks(utils.getOpFlags)),
+            (6, 'openflags'): ('openflags_int', self._flagMasks(utils.getOpenFlags)),
+        }
+
+    @staticmethod
+    def _flagMasks(getFlags) -> dict:
+        masks = {}
+        for i in range(64):
+            for flag in getFlags(1 << i):
+                masks[flag] = masks.get(flag, 0) | 1 << i
+        return masks
+
+    def _flagTest(self, lop: str, values) -> str:
+        """Returns a bitmap test for a flag attribute holding any of values, or None if it does not apply (values that are not flag names never match)."""
+        field, masks = self.flags.get(self._field(lop), (None, None))
+        # besides flag names, the pieces of the value can only be '' (no flag set) or 'None' (no section)
+        if masks is None or not values or '' in values or 'None' in values:
+            return None
+        mask = 0
+        for v in values:
+            mask |= masks.get(v, 0)
+        return '(not not ((_v := t[{0}]) and _v.{1} & {2}))'.format(self._field(lop)[0], field, mask)
+
+    def compile(self, tree: tuple, name: str = 'query') -> Callable[[T], bool]:
+        """Compile an expression tree into a predicate over flattened records.
+
+        :param tree: the intermediate representation of the expression.
+        :type tree: tuple
+
+        :param name: a name for the predicate, used in tracebacks.
+        :type name: str
+
+        :rtype: function
+        :return: the predicate.
+        """
+        self.consts = []
+        body = self._node(tree)
+        params = ', '.join('_c{0}'.format(i) for i in range(len(self.consts)))
+        source = 'def _bind({0}):\n    def criteria(t):\n        return {1}\n    return criteria\n'.format(params, body)
+        namespace = dict(self._globals)
+        exec(compile(source, '<sfql {0}>'.format(name), 'exec'), namespace)
+        criteria = namespace['_bind'](*self.consts)
+        criteria.source = source
+        return criteria
+
+    def _const(self, value) -> str:
+        for i, c in enumerate(self.consts):
+            if c.__class__ is value.__class__ and c == value:
+                return '_c{0}'.format(i)
+        self.consts.append(value)
+        return '_c{0}'.format(len(self.consts) - 1)
+
+    def _node(self, tree: tuple) -> str:
+        kind = tree[0]
+        if kind in ('or', 'and'):
+            if len(tree[1]) == 1:
+                return self._node(tree[1][0])
+            if not tree[1]:
+                return 'False' if kind == 'or' else 'True'
+            terms = mergeContains(tree[1], self.mapper) if kind == 'or' else tree[1]
+            return '({0})'.format(' {0} '.format(kind).join(map(self._node, terms)))
+        if kind == 'not':
+            return '(not {0})'.format(self._node(tree[1]))
+        if kind == 'exists':
+            return '(not not {0})'.format(self._value(tree[1]))
+        if kind == 'op':
+            return self._op(*tree[1:])
+        if kind == 'in':
+            flags = self._flagTest(tree[1], tree[2])
+            if flags:
+                return flags
+            return '(not {0}.isdisjoint(str({1}).split(\',\')))'.format(self._const(frozenset(tree[2])), self._value(tree[1]))
+        if kind == 'pmatch':
+            return self._pmatch(tree[1], tree[2])
+        raise Exception('SFQL error: unknown expression node {0}'.format(kind))
+
+    def _field(self, atom: str) -> tuple:
+        """Returns the section index and field name read by the accessor of atom, or None."""
+        accessor = self.mapper._mapper.get(atom)
+        index = self._sections.get(getattr(accessor, 'func', None))
+        return None if index is None else (index, accessor.keywords['attr'])
+
+    def _value(self, atom: str) -> str:
+        """Returns the python expression of the value of atom in a flattened record t."""
+        if not self.mapper.hasAttr(atom):
+            return self._const(self.mapper.getAttr(None, atom))
+        field = self._field(atom)
+        if field is None:
+            return '{0}(t)'.format(self._const(self.mapper._mapper[atom]))
+        index, attr = field
+        section = '(_v := t[{0}])'.format(index)
+        if index == 2 and attr == 'opflags':
+            return '(None if not {0} else _join(_getOpFlags(_v.opflags_int)))'.format(section)
+        if index == 6 and attr == 'path':
+            return "(None if not {0} else _v.directory if _v.type == 'dir' else _v.path)".format(section)
+        if index == 6 and attr == 'openflags':
+            return '(None if not {0} else _join(_getOpenFlags(_v.openflags_int)))'.format(section)
+        # nested attributes are None past a falsy step, like SfqlMapper._rgetattr
+        names = attr.split('.')
+        steps = ' or '.join(['not ' + section] + ['not (_v := _v.{0})'.format(n) for n in names[:-1]])
+        return '(None if {0} else _v.{1})'.format(steps, names[-1])
+
+    def _op(self, op: str, lop: str, rop: str) -> str:
+        value = self._value(lop)
+        if self.mapper.hasAttr(rop):
+            # the right operand is read again for each piece, as in the closure backend
+            test = self._comparisons[op].format(s='s', r='str({0})'.format(self._value(rop)))
+            return "((_x := str({0})) is None or any({1} for s in _x.split(',')))".format(value, test)
+        r = str(self.mapper.getAttr(None, rop))
+        # a piece never holds a comma, so tests of literals with commas only read the value
+        never = '(str({0}) is None)'.format(value)
+        if op == 'EQ':
+            flags = self._flagTest(lop, (r,))
+            if flags:
+                return flags
+            return "({0} in str({1}).split(','))".format(self._const(r), value)
+        if op == 'NEQ':
+            return "((_l := str({0}).split(',')).count({1}) != len(_l))".format(value, self._const(r))
+        if op == 'CONTAINS':
+            return never if ',' in r else '({0} in str({1}))'.format(self._const(r), value)
+        if op == 'ICONTAINS':
+            return never if ',' in r.lower() else '({0} in str({1}).lower())'.format(self._const(r.lower()), value)
+        if op == 'STARTSWITH':
+            if ',' in r:
+                return never
+            return '((_x := str({0})).startswith({1}) or {2} in _x)'.format(value, self._const(r), self._const(',' + r))
+        try:
+            bound = self._const(int(r))
+        except ValueError:
+            # invalid numbers raise when evaluated, after the attribute value is read
+            bound = 'int({0})'.format(self._const(r))
+        test = 'int({0}) {1} {2}'
+        compare = self._orderings[op]
+        return "(({0} if ',' not in (_x := str({1})) else any({2} for s in _x.split(','))))".format(
+            test.format('_x', compare, bound), value, test.format('s', compare, bound)
+        )
+
+    def _pmatch(self, lop: str, values: tuple) -> str:
+        if not values:
+            # the closure backend reads nothing when there is no value to match
+            return 'False'
+        value = self._value(lop)
+        values = [v for v in dict.fromkeys(values) if ',' not in v]
+        if not values:
+            return '(str({0}) is None)'.format(value)
+        if len(values) == 1:
+            return '({0} in str({1}))'.format(self._const(values[0]), value)
+        return '({0}(str({1})) is not None)'.format(self._const(substringSearch(values)), value)
+
+
+class LinePrefilter(object):
+    """
+    **LinePrefilter**
+
+    Conservative test on undecoded log lines derived from a sfql query: a line can only
+    match the query if it contains all the literals of at least one alternative. Lines
+    it rejects can be skipped without being decoded.
+
+    :param alternatives: a list of sets of literals.
+    :type alternatives: list
+    """
+
+    MAX_ALTERNATIVES = 32
+
+    # literals must only hold characters that JSON and python repr write unescaped
+    # ('<', '>' and '&' are escaped by some JSON encoders)
+    _safe = re.compile(r'[ !#-%(-;=?-\[\]-~]+')
+
+    # literals that may match the string of a value the decoder renders differently from the
+    # log: booleans (True vs. true), missing attributes (None vs. null) and numbers (1.0 vs. 1)
+    _rendered = ('True', 'False', 'None')
+    _number = re.compile(r'[-+.eE0-9]*[0-9][-+.eE0-9]*|inf|nan|Infinity|NaN', re.IGNORECASE)
+
+    def __init__(self, alternatives):
+        # literals occurring inside a longer literal of the same alternative add no constraint
+        self.alternatives = [tuple(l for l in sorted(a, key=len, reverse=True) if not any(l in m for m in a if m != l)) for a in alternatives]
+        if all(len(a) == 1 for a in self.alternatives):
+            self.match = re.compile('|'.join(re.escape(a[0]) for a in self.alternatives)).search
+        else:
+            self.match = self._matchAll
+
+    @staticmethod
+    def isSafe(literal: str):
+        if not LinePrefilter._safe.fullmatch(literal) or LinePrefilter._number.fullmatch(literal):
+            return False
+        return not any(literal in r for r in LinePrefilter._rendered)
+
+    def _matchAll(self, line: str):
+        return any(all(l in line for l in a) for a in self.alternatives)
+
+    def __call__(self, line: str):
+        return bool(self.match(line))
+
+    def __repr__(self):
+        return 'LinePrefilter({0})'.format(self.alternatives)
+
+
+class RuleIndex(object):
+    """
+    **RuleIndex**
+
+    Index of policy rules on the guards of their expressions, used by enrich to skip the
+    rules that cannot match a record. A guard is an equality or set-membership test of an
+    attribute against literals that a rule evaluates first: the first term of its
+    top-level conjunction, or a guard of each alternative of a disjunction. When none of
+    its guard tests hold, the rule would read the guard attributes, find no match, and
+    return False, so skipping it changes neither the tags of a record nor the exceptions
+    raised. Rules without a guard are always evaluated.
+
+    Each distinct test is compiled once and evaluated once per record, and the rules to
+    evaluate are looked up in a table keyed by the outcomes of the tests. If a test raises,
+    all the rules are evaluated.
+
+    :param rules: the rules, in evaluation order.
+    :type rules: iterable
+
+    :param mapper: the attribute mapper of the interpreter.
+    :type mapper: sysflow.sfql.SfqlMapper
+
+    :param compileTree: compiles an expression tree and a name into a predicate (see SfqlInterpreter._compileTree).
+    :type compileTree: function
+    """
+
+    def __init__(self, rules, mapper, compileTree):
+        self.rules = list(rules)
+        self.unguarded = []
+        # guard tests, as (attribute, values) pairs, and the positions of the rules each test guards
+        self.tests = {}
+        for i, rule in enumerate(self.rules):
+            guard = self.getGuard(rule.tree, mapper) if rule.tree else None
+            if guard is None:
+                self.unguarded.append(i)
+                continue
+            for test in guard.items():
+                self.tests.setdefault(test, []).append(i)
+        self.preds = [compileTree(('in', attr, tuple(sorted(values))), 'guard {0}'.format(attr)) for attr, values in self.tests]
+        self.table = {}
+
+    @staticmethod
+    def getGuard(tree: tuple, mapper):
+        """Returns the guard of a resolved expression (see SfqlInterpreter.resolveExpression) as a
+        dictionary from attributes to the values they are tested against, or None if the expression
+        has no guard. The expression can only be true if a piece of the value of some attribute of
+        the guard is one of its values."""
+        kind = tree[0]
+        if kind == 'or':
+            guards = [RuleIndex.getGuard(t, mapper) for t in tree[1]]
+            if not guards or None in guards:
+                return None
+            guard = {}
+            for g in guards:
+                for attr, values in g.items():
+                    guard[attr] = guard.get(attr, frozenset()) | values
+            return guard
+        if kind == 'and':
+            return RuleIndex.getGuard(tree[1][0], mapper) if tree[1] else None
+        if kind == 'op' and tree[1] == 'EQ' and mapper.hasAttr(tree[2]) and not mapper.hasAttr(tree[3]):
+            return {tree[2]: frozenset([str(mapper.getAttr(None, tree[3]))])}
+        if kind == 'in' and mapper.hasAttr(tree[1]):
+            return {tree[1]: frozenset(tree[2])}
+        return None
+
+    def candidates(self, t) -> list:
+        """Returns the rules that may match flattened record t, in evaluation order."""
+        try:
+            key = tuple([pred(t) for pred in self.preds])
+        except Exception:
+            # the guarded rules raise when evaluated, as they would without the index
+            return self.rules
+        rules = self.table.get(key)
+        if rules is None:
+            hits = set(self.unguarded)
+            for positions, hit in zip(self.tests.values(), key):
+                if hit:
+                    hits.update(positions)
+            rules = self.table[key] = [self.rules[i] for i in sorted(hits)]
+        return rules
+
+
 class Rule:
-    def __init__(self, name, desc, criteria, actions, priority, tags):
+    def __init__(self, name, desc, criteria, actions, priority, tags, attributes=frozenset(), tree=None):
         self.name = name
         self.desc = desc
         self.criteria = criteria
         self.actions = actions
         self.priority = priority
         self.tags = tags
+        self.attributes = attributes
+        self.tree = tree
 
     def getPriorityValue(self):
         return {'none': 0, 'low': 1, 'medium': 2, 'high': 3}[self.priority]
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+from antlr4 import CommonTokenStream, InputStream, ParseTreeWalker
+from sysflow.grammar.sfqlLexer import sfqlLexer
+from sysflow.grammar.sfqlListener import sfqlListener
+from sysflow.grammar.sfqlParser import sfqlParser
+
+"""
+.. module:: sysflow.sfqlantlr
+   :synopsis: ANTLR-based parser for sfql definitions, generated from grammar/sfql.g4.
+.. moduleauthor:: Frederico Araujo, Teryl Taylor
+"""
+
+
+class SfqlAntlrParser(sfqlListener):
+    """
+    **SfqlAntlrParser**
+
+    Parser for sfql definitions built on the ANTLR parser generated from grammar/sfql.g4. A
+    listener walks the parse tree and produces the intermediate representation of sfql
+    definitions (see SfqlInterpreter.load). Syntax errors are reported and recovered from;
+    their number is kept in syntaxErrors.
+
+    This module is imported by SfqlInterpreter only when the 'antlr' parser is selected, so
+    that the ANTLR runtime is not loaded with the 'descent' parser.
+    Example Usage::
+
+         definitions = SfqlAntlrParser().parse(open('policies/ttps.yaml').read())
+         interpreter = SfqlInterpreter()
+         interpreter.load(definitions)
+    """
+
+    syntaxErrors = 0
+
+    def parse(self, source) -> list:
+        """Parse sfql definitions.
+
+        :param source: sfql lists, macros, rules and query, as a string or an input stream.
+        :type source: str or antlr4.InputStream
+
+        :rtype: list
+        :return: the parsed definitions, in order.
+        """
+        input_stream = InputStream(source) if isinstance(source, str) else source
+        lexer = sfqlLexer(input_stream)
+        stream = CommonTokenStream(lexer)
+        parser = sfqlParser(stream)
+        tree = parser.definitions()
+        self._parsed = []
+        ParseTreeWalker().walk(self, tree)
+        self.syntaxErrors = parser.getNumberOfSyntaxErrors()
+        return self._parsed
+
+    def exitF_query(self, ctx: sfqlParser.F_queryContext):
+        self._parsed.append(('query', self._parseExpression(ctx.expression())))
+
+    def exitF_rule(self, ctx: sfqlParser.F_ruleContext):
+        self._parsed.append((
+            'rule',
+            ctx.text(0).getText(),
+            ctx.text(1).getText(),
+            self._parseExpression(ctx.expression()),
+            tuple(self._getItems(ctx.items(0).getText())),
+            ctx.SEVERITY().getText(),
+            tuple(self._getItems(ctx.items(1).getText())),
+        ))
+
+    def exitF_macro(self, ctx: sfqlParser.F_macroContext):
+        self._parsed.append(('macro', ctx.ID().getText(), self._parseExpression(ctx.expression())))
+
+    def exitF_list(self, ctx: sfqlParser.F_listContext):
+        self._parsed.append(('list', ctx.ID().getText(), tuple(item.getText().strip('\"') for item in ctx.items().atom())))
+
+    def _parseExpression(self, ctx: sfqlParser.ExpressionContext) -> tuple:
+        or_expression = ctx.getChild(0)
+        or_terms = []
+        if or_expression.getChildCount() > 0:
+            for and_expression in or_expression.getChildren():
+                if and_expression.getChildCount() > 0:
+                    and_terms = []
+                    for term in and_expression.getChildren():
+                        if isinstance(term, sfqlParser.TermContext):
+                            and_terms.append(self._parseTerm(term))
+                    or_terms.append(('and', tuple(and_terms)))
+        return ('or', tuple(or_terms))
+
+    def _parseTerm(self, ctx: sfqlParser.TermContext) -> tuple:
+        if ctx.var():
+            return ('var', ctx.var().getText())
+        elif ctx.NOT():
+            return ('not', self._parseTerm(ctx.getChild(1)))
+        elif ctx.unary_operator():
+            if ctx.unary_operator().EXISTS():
+                return ('exists', ctx.getChild(0).getText())
+        elif ctx.binary_operator():
+            op = sfqlParser.symbolicNames[ctx.binary_operator().getChild(0).symbol.type]
+            return ('op', op, ctx.atom(0).getText(), ctx.atom(1).getText())
+        elif ctx.expression():
+            return self._parseExpression(ctx.expression())
+        elif ctx.IN() or ctx.PMATCH():
+            items = tuple(item.getText().strip('\"') for item in ctx.atom()[1:])
+            return ('in' if ctx.IN() else 'pmatch', ctx.atom(0).getText(), items)
+        raise Exception('SFQL syntax error: unrecognized term {0}'.format(ctx.getText()))
+
+    def _getItems(self, l: str) -> list:
+        return l[1:-1].split(',')
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+
+import re
+
+"""
+.. module:: sysflow.sfqlparse
+   :synopsis: Dependency-free recursive-descent parser for sfql definitions (see grammar/sfql.g4).
+.. moduleauthor:: Frederico Araujo, Teryl Taylor
+"""
+
+# token types, named as in the ANTLR grammar
+KEYWORDS = {
+    'sfql': 'QUERY',
+    'rule': 'RULE',
+    'macro': 'MACRO',
+    'list': 'LIST',
+    'items': 'ITEMS',
+    'condition': 'COND',
+    'desc': 'DESC',
+    'action': 'ACTION',
+    'priority': 'PRIORITY',
+    'tags': 'TAGS',
+    'and': 'AND',
+    'or': 'OR',
+    'not': 'NOT',
+    'in': 'IN',
+    'contains': 'CONTAINS',
+    'icontains': 'ICONTAINS',
+    'startswith': 'STARTSWITH',
+    'pmatch': 'PMATCH',
+    'exists': 'EXISTS',
+    'high': 'SEVERITY',
+    'medium': 'SEVERITY',
+    'low': 'SEVERITY',
+    'none': 'SEVERITY',
+}
+
+SYMBOLS = {
+    '<=': 'LE',
+    '>=': 'GE',
+    '!=': 'NEQ',
+    '<': 'LT',
+    '>': 'GT',
+    '=': 'EQ',
+    '[': 'LBRACK',
+    ']': 'RBRACK',
+    '(': 'LPAREN',
+    ')': 'RPAREN',
+    ',': 'LISTSEP',
+    '-': 'DECL',
+}
+
+BINARY_OPERATORS = frozenset(['LT', 'LE', 'GT', 'GE', 'EQ', 'NEQ', 'CONTAINS', 'ICONTAINS', 'STARTSWITH'])
+ATOMS = ('ID', 'PATH', 'NUMBER', 'TAG', 'STRING', 'LT', 'GT')
+
+_PATH = r'[a-zA-Z/][a-zA-Z0-9_\-./*]*'
+_NUMBER = r'[0-9]+(?:\.[0-9]+)?'
+_ID = r'[a-zA-Z0-9_](?:[a-zA-Z0-9_\-.*]|:?\[(?:{0}|{1})(?::{1})*\])*'.format(_NUMBER, _PATH)
+_WORDS = [('ID', re.compile(_ID)), ('PATH', re.compile(_PATH)), ('TAG', re.compile('{0}:{0}'.format(_ID)))]
+_WORD_START = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_/')
+_WS = re.compile(r'[ \t\r\n\f]+')
+_COMMENT = re.compile(r'#[^\r\n]*')
+_DEF = re.compile(r':(?: *>)?')
+_STRING_DELIMITERS = ('"', "'", '\\"', "''")
+
+
+# The STRING rule nests strings and ends a string body at the first closing delimiter
+# (non-greedy), with ANTLR's precedence between the two: the rule is simulated the way the
+# ANTLR lexer does, over an ordered set of (state, return stack, passed non-greedy loop)
+# configurations. Match states are ('open', alt, i), ('close', alt, i) and ('body',);
+# ('call', alt, branch) return states sort like the ATN states they stand for.
+_MATCH = frozenset(['open', 'close', 'body'])
+
+
+def _stringClosure(state, stack, nongreedy, configs, accepted):
+    kind = state[0]
+    if kind == 'stop':
+        if not stack:
+            configs.setdefault((state, stack, nongreedy))
+            return True
+        return _stringClosure(('return', stack[-1]), stack[:-1], nongreedy, configs, accepted)
+    if kind in _MATCH:
+        # once the token was accepted, configurations past the non-greedy loop are dropped
+        if not accepted or not nongreedy:
+            configs.setdefault((state, stack, nongreedy))
+        return accepted
+    if kind == 'start':
+        for alt in range(len(_STRING_DELIMITERS)):
+            accepted = _stringClosure(('open', alt, 0), stack, nongreedy, configs, accepted)
+    elif kind == 'block':
+        accepted = _stringClosure(('start',), stack + ((state[1], 0),), nongreedy, configs, accepted)
+        accepted = _stringClosure(('loop',), stack + ((state[1], 1),), True, configs, accepted)
+    elif kind == 'loop':
+        # the exit of the non-greedy loop comes first
+        accepted = _stringClosure(('stop',), stack, nongreedy, configs, accepted)
+        accepted = _stringClosure(('body',), stack, nongreedy, configs, accepted)
+    elif kind == 'return':
+        accepted = _stringClosure(('close', state[1][0], 0), stack, nongreedy, configs, accepted)
+    return accepted
+
+
+def _stringEnd(text, pos):
+    """Returns the end of the STRING token starting at pos, or None."""
+    configs = {}
+    _stringClosure(('start',), (), False, configs, False)
+    end = None
+    while configs and pos < len(text):
+        c = text[pos]
+        pos += 1
+        reach = {}
+        accepted = False
+        for state, stack, nongreedy in configs:
+            if accepted and nongreedy:
+                continue
+            kind = state[0]
+            if kind == 'stop':
+                continue
+            if kind == 'body':
+                if c in '\r\n':
+                    continue
+                target = ('loop',)
+            else:
+                delimiter = _STRING_DELIMITERS[state[1]]
+                if c != delimiter[state[2]]:
+                    continue
+                if state[2] + 1 < len(delimiter):
+                    target = (kind, state[1], state[2] + 1)
+                else:
+                    target = ('block', state[1]) if kind == 'open' else ('stop',)
+            if _stringClosure(target, stack, nongreedy, reach, accepted):
+                accepted = True
+        if any(state[0] == 'stop' for state, stack, nongreedy in reach):
+            end = pos
+        configs = reach
+    return end
+
+
+def tokenize(text: str) -> list:
+    """Split sfql text into tokens, the way the ANTLR lexer generated from grammar/sfql.g4 does:
+    the longest match wins, and keywords win over identifiers of the same length. Whitespace and
+    comments are dropped.
+
+    :param text: sfql definitions.
+    :type text: str
+
+    :rtype: list
+    :return: (type, text, line, column) tuples.
+    """
+    tokens = []
+    pos = 0
+    line, lineStart = 1, 0
+    size = len(text)
+    while pos < size:
+        c = text[pos]
+        kind, end = 'ANY', pos + 1
+        if c in _WORD_START:
+            end = pos
+            for name, pattern in _WORDS:
+                m = pattern.match(text, pos)
+                if m and m.end() > end:
+                    kind, end = name, m.end()
+            if kind == 'ID' and text[pos:end] in KEYWORDS:
+                kind = KEYWORDS[text[pos:end]]
+        elif c in ' \t\r\n\f':
+            kind, end = None, _WS.match(text, pos).end()
+        elif c == '#':
+            kind, end = None, _COMMENT.match(text, pos).end()
+        elif c == ':':
+            kind, end = 'DEF', _DEF.match(text, pos).end()
+        elif c in '"\'\\':
+            stringEnd = _stringEnd(text, pos)
+            if stringEnd:
+                kind, end = 'STRING', stringEnd
+        elif text[pos:pos + 2] in SYMBOLS:
+            kind, end = SYMBOLS[text[pos:pos + 2]], pos + 2
+        elif c in SYMBOLS:
+            kind = SYMBOLS[c]
+        if kind:
+            tokens.append((kind, text[pos:end], line, pos - lineStart))
+        newlines = text.count('\n', pos, end)
+        if newlines:
+            line += newlines
+            lineStart = text.rfind('\n', pos, end) + 1
+        pos = end
+    return tokens
+
+
+class SfqlDescentParser(object):
+    """
+    **SfqlDescentParser**
+
+    Hand-written recursive-descent parser for the grammar in grammar/sfql.g4, producing the same
+    intermediate representation of sfql definitions as the ANTLR listener of SfqlInterpreter
+    (see SfqlInterpreter.load), without the ANTLR runtime.
+
+    Like the generated parser, it stops silently at the first token that cannot start a
+    definition, and after a query. Other syntax errors raise an exception instead of being
+    reported and recovered from.
+    Example Usage::
+
+         definitions = SfqlDescentParser().parse(open('policies/ttps.yaml').read())
+         interpreter = SfqlInterpreter(parser='descent')
+         interpreter.load(definitions)
+    """
+
+    _definitions = {'MACRO': '_parseMacro', 'LIST': '_parseList', 'RULE': '_parseRule', 'QUERY': '_parseQuery'}
+
+    def parse(self, text: str) -> list:
+        """Parse sfql definitions.
+
+        :param text: sfql lists, macros, rules and query.
+        :type text: str
+
+        :rtype: list
+        :return: the parsed definitions, in order.
+        """
+        self.tokens = tokenize(text) + [('EOF', '<EOF>', text.count('\n') + 1, len(text) - text.rfind('\n') - 1)]
+        self.pos = 0
+        definitions = []
+        while self._peek() == 'DECL' and self._peek(1) in self._definitions:
+            self.pos += 1
+            definitions.append(getattr(self, self._definitions[self._peek()])())
+            if definitions[-1][0] == 'query':
+                break
+        if self._peek() == 'DECL':
+            self._error('a definition')
+        return definitions
+
+    def _peek(self, offset: int = 0) -> str:
+        return self.tokens[min(self.pos + offset, len(self.tokens) - 1)][0]
+
+    def _next(self) -> str:
+        text = self.tokens[self.pos][1]
+        self.pos += 1
+        return text
+
+    def _expect(self, *kinds) -> str:
+        if self._peek() not in kinds:
+            self._error(' or '.join(kinds))
+        return self._next()
+
+    def _error(self, expected: str):
+        kind, text, line, column = self.tokens[self.pos]
+        raise Exception('SFQL syntax error: line {0}:{1} mismatched input {2!r} expecting {3}'.format(line, column, text, expected))
+
+    def _parseQuery(self) -> tuple:
+        self._expect('QUERY')
+        self._expect('DEF')
+        return ('query', self._parseExpression())
+
+    def _parseMacro(self) -> tuple:
+        self._expect('MACRO')
+        self._expect('DEF')
+        name = self._expect('ID')
+        self._expect('COND')
+        self._expect('DEF')
+        return ('macro', name, self._parseExpression())
+
+    def _parseList(self) -> tuple:
+        self._expect('LIST')
+        self._expect('DEF')
+        name = self._expect('ID')
+        self._expect('ITEMS')
+        self._expect('DEF')
+        return ('list', name, tuple(item.strip('\"') for item in self._parseItems()))
+
+    def _parseRule(self) -> tuple:
+        self._expect('RULE')
+        self._expect('DEF')
+        name = self._parseText('DESC')
+        desc = self._parseText('COND')
+        condition = self._parseExpression()
+        self._expect('ACTION')
+        self._expect('DEF')
+        actions = self._getItems(self._parseItems())
+        self._expect('PRIORITY')
+        self._expect('DEF')
+        priority = self._expect('SEVERITY')
+        self._expect('TAGS')
+        self._expect('DEF')
+        tags = self._getItems(self._parseItems())
+        return ('rule', name, desc, condition, actions, priority, tags)
+
+    def _parseText(self, until: str) -> str:
+        """Returns the text of the tokens up to the next until keyword that is followed by a colon, which is consumed."""
+        start = self.pos
+        self._next()
+        while not (self._peek() == until and self._peek(1) == 'DEF'):
+            if self._peek() == 'EOF':
+                self._error(until)
+            self._next()
+        text = ''.join(t[1] for t in self.tokens[start:self.pos])
+        self.pos += 2
+        return text
+
+    def _parseItems(self) -> list:
+        self._expect('LBRACK')
+        items = []
+        if self._peek() != 'RBRACK':
+            items.append(self._parseAtom())
+            while self._peek() == 'LISTSEP':
+                self._next()
+                items.append(self._parseAtom())
+        self._expect('RBRACK')
+        return items
+
+    @staticmethod
+    def _getItems(items: list) -> tuple:
+        # as the ANTLR listener does, split the text of the list on commas
+        return tuple(','.join(items).split(','))
+
+    def _parseAtom(self) -> str:
+        return self._expect(*ATOMS)
+
+    def _parseExpression(self) -> tuple:
+        or_terms = [self._parseAnd()]
+        while self._peek() == 'OR':
+            self._next()
+            or_terms.append(self._parseAnd())
+        return ('or', tuple(or_terms))
+
+    def _parseAnd(self) -> tuple:
+        and_terms = [self._parseTerm()]
+        while self._peek() == 'AND':
+            self._next()
+            and_terms.append(self._parseTerm())
+        return ('and', tuple(and_terms))
+
+    def _parseTerm(self) -> tuple:
+        kind = self._peek()
+        if kind == 'NOT':
+            self._next()
+            return ('not', self._parseTerm())
+        if kind == 'LPAREN':
+            self._next()
+            expression = self._parseExpression()
+            self._expect('RPAREN')
+            return expression
+        following = self._peek(1)
+        if kind == 'ID' and following != 'EXISTS' and following not in BINARY_OPERATORS and following not in ('IN', 'PMATCH'):
+            return ('var', self._next())
+        lop = self._parseAtom()
+        if following == 'EXISTS':
+            self._next()
+            return ('exists', lop)
+        if following in BINARY_OPERATORS:
+            operator = self._peek()
+            self._next()
+            return ('op', operator, lop, self._parseAtom())
+        operator = 'in' if self._peek() == 'IN' else 'pmatch'
+        self._expect('IN', 'PMATCH')
+        self._expect('LPAREN')
+        values = []
+        while True:
+            if self._peek() == 'LBRACK':
+                # items nested in a value list are parsed, but not part of the values
+                self._parseItems()
+            else:
+                values.append(self._parseAtom().strip('\"'))
+            if self._peek() != 'LISTSEP':
+                break
+            self._next()
+        self._expect('RPAREN')
+        return (operator, lop, tuple(values))